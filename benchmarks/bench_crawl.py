@@ -0,0 +1,236 @@
+"""End-to-end crawl benchmark against the local mock PHHC server
+
+Starts benchmarks/mock_server.py in-process, runs each spider in its own
+subprocess against it (with the project settings, plus any --set
+overrides) and reports requests/sec, items/sec, p50/p99 callback latency
+and peak RSS. Results are written as JSON so runs under different settings
+can be compared.
+
+Usage:
+    python benchmarks/bench_crawl.py --latency 0.05 --output bench_crawl.json
+    python benchmarks/bench_crawl.py --set CONCURRENT_REQUESTS=32 --spider phhc_case_form_dynamic
+"""
+
+import argparse
+import inspect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_server
+
+
+SPIDERS = ['phhc_case_form_dynamic', 'phhc_judgments_chunked']
+
+# Settings recorded alongside every result, to tell runs apart
+REPORTED_SETTINGS = [
+    'CONCURRENT_REQUESTS', 'CONCURRENT_REQUESTS_PER_DOMAIN', 'DOWNLOAD_DELAY',
+    'AUTOTHROTTLE_ENABLED', 'AUTOTHROTTLE_TARGET_CONCURRENCY', 'AIMD_ENABLED', 'ITEM_PIPELINES',
+    'PARSE_POOL_WORKERS',
+]
+
+
+def reported_settings(settings):
+    from scrapy.settings import BaseSettings
+
+    values = {}
+    for name in REPORTED_SETTINGS:
+        value = settings.get(name)
+        if isinstance(value, BaseSettings):
+            value = value.copy_to_dict()
+        values[name] = value
+    return values
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def timed_callback(func, samples):
+    """Wrap a spider callback, timing the call and the iteration of its output
+
+    Coroutine callbacks (the *_pooled ones, with PARSE_POOL_WORKERS) are
+    timed until they return, so their samples are end-to-end latencies that
+    include waiting for a pool worker.
+    """
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(self, *args, **kwargs)
+        if inspect.iscoroutine(result):
+            return _timed_coroutine(result, start, samples)
+        elapsed = time.perf_counter() - start
+        if result is None or not hasattr(result, '__next__'):
+            samples.append(elapsed)
+            return result
+        return _timed_iter(result, elapsed, samples)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def _timed_iter(iterator, elapsed, samples):
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            yield value
+    finally:
+        samples.append(elapsed)
+
+
+async def _timed_coroutine(coroutine, start, samples):
+    try:
+        return await coroutine
+    finally:
+        samples.append(time.perf_counter() - start)
+
+
+def run_worker(spider_name, port, overrides, timeout):
+    """Run one spider in this process and print its metrics as JSON"""
+    import resource
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.spiderloader import SpiderLoader
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.setdict({
+        'LOG_FILE': None,
+        'LOG_STDOUT': False,
+        'LOG_LEVEL': 'ERROR',
+        'CLOSESPIDER_TIMEOUT': timeout,
+        'TELNETCONSOLE_ENABLED': False,
+    }, priority='cmdline')
+    settings.setdict(overrides, priority='cmdline')
+
+    spidercls = SpiderLoader.from_settings(settings).load(spider_name)
+    samples = []
+    callbacks = {
+        name: timed_callback(getattr(spidercls, name), samples)
+        for name in ('parse', 'parse_case_types', 'save_response', 'save_response_pooled',
+                     'parse_results', 'parse_results_pooled')
+        if name in vars(spidercls)
+    }
+    bench_spidercls = type(spidercls.__name__, (spidercls,), callbacks)
+
+    url = f"http://127.0.0.1:{port}/home.php?search_param=free_text_search_judgment"
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(bench_spidercls)
+    process.crawl(crawler, start_url=url, start_urls=[url], allowed_domains=['127.0.0.1'])
+    process.start()
+
+    stats = crawler.stats.get_stats()
+    elapsed = (stats['finish_time'] - stats['start_time']).total_seconds()
+    requests = stats.get('downloader/request_count', 0)
+    # phhc_judgments_chunked exports its rows itself instead of yielding items
+    items = stats.get('item_scraped_count', 0) or getattr(crawler.spider, 'row_count', 0)
+    # With a parse pool the callback samples include the wait for a worker;
+    # the workers' own parse time is reported separately
+    pool = getattr(crawler.spider, 'parse_pool', None)
+    pool_stats = None
+    if pool is not None:
+        pages = pool.stats['pages_parsed']
+        pool_stats = dict(pool.stats, worker_ms_per_page=pool.stats['worker_cpu_seconds'] / pages * 1000 if pages else 0)
+    result = {
+        'spider': spider_name,
+        'finish_reason': stats.get('finish_reason'),
+        'elapsed_sec': elapsed,
+        'requests': requests,
+        'responses': stats.get('downloader/response_count', 0),
+        'items': items,
+        'requests_per_sec': requests / elapsed if elapsed > 0 else 0,
+        'items_per_sec': items / elapsed if elapsed > 0 else 0,
+        'callbacks': len(samples),
+        'callback_p50_ms': (percentile(samples, 0.50) or 0) * 1000,
+        'callback_p99_ms': (percentile(samples, 0.99) or 0) * 1000,
+        'parse_pool': pool_stats,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'settings': reported_settings(settings),
+    }
+    print(json.dumps(result, default=str))
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        overrides[name] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spider', action='append', choices=SPIDERS,
+                        help="spider to run (default: all)")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="override a Scrapy setting for the benchmark crawls")
+    parser.add_argument('--timeout', type=int, default=120,
+                        help="CLOSESPIDER_TIMEOUT for each crawl, in seconds")
+    parser.add_argument('--output', default='bench_crawl.json')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    mock_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    overrides = parse_overrides(args.set)
+    if args.worker:
+        run_worker(args.worker, args.port, overrides, args.timeout)
+        return
+
+    server = mock_server.make_server(0, **mock_server.server_options(args))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    env = dict(os.environ, SCRAPY_SETTINGS_MODULE='phhc_crawler.settings')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get('PYTHONPATH')]))
+    results = []
+    for spider_name in args.spider or SPIDERS:
+        command = [sys.executable, os.path.abspath(__file__), '--worker', spider_name,
+                   '--port', str(server.server_port), '--timeout', str(args.timeout)]
+        for pair in args.set:
+            command += ['--set', pair]
+        # Each crawl runs in a scratch directory so exports and state files
+        # from the pipelines do not leak into the project
+        with tempfile.TemporaryDirectory() as workdir:
+            completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if completed.returncode != 0 or not completed.stdout.strip():
+            sys.stderr.write(completed.stderr)
+            sys.exit(f"Benchmark crawl failed for {spider_name}")
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(
+            f"{spider_name:<24} {result['requests_per_sec']:8.1f} req/s "
+            f"{result['items_per_sec']:9.1f} items/s  "
+            f"p50 {result['callback_p50_ms']:7.2f} ms  p99 {result['callback_p99_ms']:7.2f} ms  "
+            f"RSS {result['peak_rss_mb']:7.1f} MB  ({result['finish_reason']})"
+        )
+    server.shutdown()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'server': mock_server.server_options(args),
+        'overrides': overrides,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Result-page parsing micro-benchmark
+
+Compares the per-cell selector extraction that save_response used to run
+with the single-pass lxml extractor in phhc_crawler.extractors.
+
+Usage:
+    python benchmarks/bench_parsing.py [PAGE.html ...]
+
+Without arguments every ``*.html`` file in benchmarks/fixtures is used; if
+there are none, a synthetic results page is generated. Saved pages can be
+dropped into the fixtures directory (e.g. from a recorded crawl).
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scrapy.http import HtmlResponse
+
+from phhc_crawler.extractors import extract_result_rows
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGE_URL = "https://www.phhc.gov.in/home.php?search_param=free_text_search_judgment"
+
+
+def synthetic_page(rows=500):
+    """Results page shaped like table#tables11 on phhc.gov.in"""
+    body = [
+        '<html><body><table id="tables11">',
+        '<tr><th>Sr No</th><th>Case No</th><th>Party Detail</th>'
+        '<th>Decision Date</th><th>Judge</th><th>Order</th></tr>',
+    ]
+    for i in range(rows):
+        body.append(
+            f'<tr><td>{i + 1}</td><td>CRM-M-{1000 + i}-2026</td>'
+            f'<td>PETITIONER {i} <br>VS<br> STATE OF PUNJAB</td>'
+            f'<td>{i % 28 + 1:02d}/03/2026</td><td>HON\'BLE MR. JUSTICE X</td>'
+            f'<td><a href="#" OnClick="window.open(\'show_order.php?id={i}\')">View Order</a></td></tr>'
+        )
+    body.append('</table></body></html>')
+    return '\n'.join(body).encode('utf-8')
+
+
+def legacy_extract(response):
+    """Selector-per-cell extraction previously inlined in save_response"""
+    table = response.css('table#tables11')
+    headers = table.css('tr th::text').getall()
+    rows = []
+    for row in table.css('tr')[1:]:
+        columns = {}
+        links = []
+        for i, cell in enumerate(row.css('td')):
+            text = cell.css('::text').get(default='').strip()
+            columns[headers[i] if i < len(headers) else f'col_{i}'] = text
+            for a in cell.xpath('.//a[text()="View Order"]'):
+                onclick = a.attrib.get('OnClick') or a.attrib.get('onclick', '')
+                m = re.search(r"window\.open\('([^']+)'\)", onclick)
+                if m:
+                    links.append(response.urljoin(m.group(1)))
+        rows.append((columns, links))
+    return rows
+
+
+def lxml_extract(response):
+    return extract_result_rows(response.selector.root, response.urljoin)
+
+
+def bench(name, extract, pages, repeat):
+    rows = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for body in pages:
+            # A fresh response per pass so the parse cost is included
+            response = HtmlResponse(url=PAGE_URL, body=body, encoding='utf-8')
+            rows += len(extract(response))
+    elapsed = time.perf_counter() - start
+    rate = rows / elapsed if elapsed > 0 else 0
+    print(f"{name:<10} {rows:>8} rows  {elapsed:8.3f} s  {rate:12.0f} rows/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pages', nargs='*', help="saved result pages (HTML)")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=500, help="rows in the synthetic page")
+    args = parser.parse_args()
+
+    paths = args.pages or sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html')))
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    if not pages:
+        print(f"No fixtures found, using a synthetic page with {args.rows} rows")
+        pages = [synthetic_page(args.rows)]
+
+    # Both paths must produce identical rows before their speed is compared
+    for body in pages:
+        response = HtmlResponse(url=PAGE_URL, body=body, encoding='utf-8')
+        if legacy_extract(response) != lxml_extract(response):
+            sys.exit("Extractors disagree on a fixture page")
+
+    legacy_rate = bench('selectors', legacy_extract, pages, args.repeat)
+    lxml_rate = bench('lxml', lxml_extract, pages, args.repeat)
+    if legacy_rate:
+        print(f"speedup    {lxml_rate / legacy_rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
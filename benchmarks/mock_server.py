@@ -0,0 +1,204 @@
+"""Local stand-in for phhc.gov.in/home.php used by the crawl benchmarks
+
+Serves the case-type select on GET, and paginated table#tables11 results
+for both spiders' search forms on POST (and on GET for "Next" links).
+Searches whose date window holds more than --refine-rows rows get the
+"refine your query" page instead of results. With --session-ttl, GET
+home.php hands out a PHPSESSID cookie that searches must present; missing
+or expired sessions get an empty page, as the real site does. --error-rate
+answers that share of searches with a transient HTTP 500.
+
+Usage:
+    python benchmarks/mock_server.py --port 8765 --latency 0.05
+"""
+
+import argparse
+import datetime
+import hashlib
+import random
+import secrets
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y')
+
+
+class MockConfig:
+    def __init__(self, case_types=20, rows_per_day=3, refine_rows=200, page_size=50,
+                 latency=0.0, padding=0, session_ttl=0.0, error_rate=0.0):
+        # CRM-M is the case type phhc_judgments_chunked searches for
+        self.case_types = ['CRM-M'] + [f'CT{i:02d}' for i in range(1, case_types)]
+        self.rows_per_day = rows_per_day
+        self.refine_rows = refine_rows
+        self.page_size = page_size
+        self.latency = latency
+        self.padding = padding
+        self.session_ttl = session_ttl
+        self.error_rate = error_rate
+        # {session id: expiry timestamp}
+        self.sessions = {}
+
+
+def parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def rows_for_day(config, case_type, day):
+    """Deterministic, uneven row count: some case types are busy, most are sparse"""
+    seed = hashlib.md5(f'{case_type}:{day.isoformat()}'.encode()).digest()
+    busy = config.case_types.index(case_type) % 5 == 0
+    return seed[0] % (config.rows_per_day * (8 if busy else 1) + 1)
+
+
+class MockPHHCHandler(BaseHTTPRequestHandler):
+    config = MockConfig()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        params = dict(parse_qsl(urlsplit(self.path).query, keep_blank_values=True))
+        if 'page' in params:
+            self.search(params)
+        else:
+            self.home()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = dict(parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True))
+        self.search(params)
+
+    def has_session(self):
+        cookie = SimpleCookie(self.headers.get('Cookie', ''))
+        morsel = cookie.get('PHPSESSID')
+        expires = self.config.sessions.get(morsel.value) if morsel else None
+        return expires is not None and expires > time.time()
+
+    def send_html(self, html, cookie=None, status=200):
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        body = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if cookie:
+            self.send_header('Set-Cookie', f'PHPSESSID={cookie}; path=/')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def home(self):
+        options = ''.join(f'<option value="{ct}">{ct}</option>' for ct in self.config.case_types)
+        session = None
+        if self.config.session_ttl:
+            session = secrets.token_hex(8)
+            self.config.sessions[session] = time.time() + self.config.session_ttl
+        self.send_html(
+            '<html><body><form method="post">'
+            f'<select name="t_case_type"><option value="">--Select--</option>{options}</select>'
+            '</form></body></html>',
+            cookie=session,
+        )
+
+    def search(self, params):
+        # phhc_case_form_dynamic posts from_date/to_date/t_case_type,
+        # phhc_judgments_chunked posts dfrom/dto/ctype
+        case_type = params.get('t_case_type') or params.get('ctype', '')
+        start = parse_date(params.get('from_date') or params.get('dfrom'))
+        end = parse_date(params.get('to_date') or params.get('dto'))
+        page = int(params.get('page', 1) or 1)
+        if self.config.session_ttl and not self.has_session():
+            self.send_html('')
+            return
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            self.send_html('<html><body>Internal Server Error</body></html>', status=500)
+            return
+        if case_type not in self.config.case_types or start is None or end is None:
+            self.send_html('<html><body>No record found</body></html>')
+            return
+
+        rows = []
+        day = start
+        while day <= end:
+            for n in range(rows_for_day(self.config, case_type, day)):
+                rows.append((day, n))
+            day += datetime.timedelta(days=1)
+
+        if len(rows) > self.config.refine_rows:
+            self.send_html('<html><body>Too many records, please refine your query</body></html>')
+            return
+
+        first = (page - 1) * self.config.page_size
+        page_rows = rows[first:first + self.config.page_size]
+        padding = 'x' * self.config.padding
+        html = [
+            '<html><body><table id="tables11"><tbody>',
+            '<tr><th>Sr No</th><th>Case No</th><th>Party Detail</th>'
+            '<th>Decision Date</th><th>Judge</th><th>Order</th></tr>',
+        ]
+        for i, (day, n) in enumerate(page_rows, start=first + 1):
+            order_id = f'{case_type}-{day:%Y%m%d}-{n}'
+            html.append(
+                f'<tr><td>{i}</td><td>{case_type}-{n + 1}-{day.year}</td>'
+                f'<td>PETITIONER {n} VS STATE {padding}</td><td>{day:%d/%m/%Y}</td>'
+                '<td>JUSTICE MOCK</td>'
+                f'<td><a href="#" OnClick="window.open(\'show_order.php?id={order_id}\')">View Order</a></td></tr>'
+            )
+        if first + self.config.page_size < len(rows):
+            query = dict(params, page=page + 1)
+            html.append(f'<tr><td colspan="6"><a href="home.php?{urlencode(query)}">Next</a></td></tr>')
+        html.append('</tbody></table></body></html>')
+        self.send_html('\n'.join(html))
+
+
+def make_server(port=0, **options):
+    handler = type('ConfiguredHandler', (MockPHHCHandler,), {'config': MockConfig(**options)})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+def add_arguments(parser):
+    parser.add_argument('--case-types', type=int, default=20)
+    parser.add_argument('--rows-per-day', type=int, default=3)
+    parser.add_argument('--refine-rows', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--padding', type=int, default=0, help="extra bytes per result row")
+    parser.add_argument('--session-ttl', type=float, default=0.0,
+                        help="require a home.php session cookie that expires after this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="share of searches answered with a transient HTTP 500")
+
+
+def server_options(args):
+    return {
+        'case_types': args.case_types,
+        'rows_per_day': args.rows_per_day,
+        'refine_rows': args.refine_rows,
+        'page_size': args.page_size,
+        'latency': args.latency,
+        'padding': args.padding,
+        'session_ttl': args.session_ttl,
+        'error_rate': args.error_rate,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(args.port, **server_options(args))
+    print(f"Mock PHHC server on http://127.0.0.1:{server.server_port}/home.php")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# Columnar cleaning and validation of item micro-batches
+#
+# Used by DataValidationPipeline when VALIDATION_BATCH_SIZE is set: instead
+# of one pass over every field of every item, each field of a batch is
+# gathered into a column once and cleaned and checked with numpy string
+# operations and boolean masks. Results stay per item (which values
+# changed, which required fields are missing, which rows have no parseable
+# date), so drops and stats are still reported item by item.
+
+import datetime
+from operator import attrgetter
+
+import numpy as np
+from itemadapter import ItemAdapter
+
+from .items import CaseRowItem
+
+
+REQUIRED_FIELDS = ('date', 'case_type', 'links')
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d')
+DECISION_DATE_HEADER = 'decision date'
+
+# {RowSchema: header of its decision date column, or None}
+_decision_headers = {}
+
+
+def decision_date_header(columns):
+    """Header of the row's "Decision Date" column, looked up once per RowSchema"""
+    schema = getattr(columns, 'schema', None)
+    if schema is not None and schema in _decision_headers:
+        return _decision_headers[schema]
+    header = next((h for h in columns if h.strip().lower() == DECISION_DATE_HEADER), None)
+    if schema is not None:
+        _decision_headers[schema] = header
+    return header
+
+
+def strip_column(values):
+    """Stripped copy of a column and a mask of the entries that changed (strings only)"""
+    size = len(values)
+    changed = np.zeros(size, dtype=bool)
+    is_str = np.fromiter((type(value) is str for value in values), dtype=bool, count=size)
+    if not is_str.any():
+        # Not a string column (links, columns, numbers)
+        return values, changed
+    index = np.flatnonzero(is_str)
+    strings = np.array(values if len(index) == size else [values[i] for i in index.tolist()], dtype=str)
+    stripped = np.char.strip(strings)
+    changed[index] = stripped != strings
+    if not changed.any():
+        return values, changed
+    values = list(values)
+    for i, value in zip(index.tolist(), stripped.tolist()):
+        values[i] = value
+    return values, changed
+
+
+def _is_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.datetime.strptime(value, fmt)
+            return True
+        except ValueError:
+            continue
+    return False
+
+
+def parse_dates(values):
+    """Mask of the values that parse with any of DATE_FORMATS
+
+    Dates repeat heavily within a batch (rows of one page share a date
+    window), so each distinct string is parsed once.
+    """
+    parsed = {value: _is_date(value) for value in set(values) if type(value) is str}
+    return np.fromiter((parsed.get(value, False) if type(value) is str else False for value in values),
+                       dtype=bool, count=len(values))
+
+
+def present(values):
+    """Boolean mask of values that are set and non-empty"""
+    return np.fromiter(map(bool, values), dtype=bool, count=len(values))
+
+
+def _gather(items):
+    """({field: column of values}, adapters) for a batch
+
+    A batch of CaseRowItems is read straight from its slots; anything
+    else goes through ItemAdapter, whose adapters are returned for
+    writing back.
+    """
+    if all(type(item) is CaseRowItem for item in items):
+        return {field: list(map(attrgetter(field), items)) for field in CaseRowItem.__slots__}, None
+    adapters = [ItemAdapter(item) for item in items]
+    fields = dict.fromkeys(name for adapter in adapters for name in adapter.keys())
+    return {field: [adapter.get(field) for adapter in adapters] for field in fields}, adapters
+
+
+def clean_batch(items):
+    """Strip string fields in place and check a batch of items
+
+    Returns (columns, missing, undated): the cleaned {field: values}
+    columns, for every item the tuple of missing required fields, and a
+    mask of items where neither ``date`` nor the Decision Date column is
+    a parseable date.
+    """
+    columns, adapters = _gather(items)
+    for field, values in columns.items():
+        stripped, changed = strip_column(values)
+        if not changed.any():
+            continue
+        for i in np.flatnonzero(changed).tolist():
+            if adapters is None:
+                setattr(items[i], field, stripped[i])
+            else:
+                adapters[i][field] = stripped[i]
+        columns[field] = stripped
+
+    size = len(items)
+    masks = {field: present(columns[field]) if field in columns else np.zeros(size, dtype=bool)
+             for field in REQUIRED_FIELDS}
+    missing_any = ~np.logical_and.reduce([masks[field] for field in REQUIRED_FIELDS])
+    missing = [()] * size
+    for i in np.flatnonzero(missing_any).tolist():
+        missing[i] = tuple(field for field in REQUIRED_FIELDS if not masks[field][i])
+
+    dated = parse_dates(columns.get('date', [None] * size))
+    undated = np.flatnonzero(~dated).tolist()
+    if undated and 'columns' in columns:
+        # Fall back to the Decision Date column for rows without a usable date
+        decision_dates = []
+        for i in undated:
+            row_columns = columns['columns'][i]
+            header = decision_date_header(row_columns) if row_columns else None
+            decision_dates.append(row_columns[header] if header else None)
+        dated[undated] = parse_dates(decision_dates)
+    return columns, missing, ~dated
@@ -0,0 +1 @@
+# Custom scrapy commands for the phhc_crawler project (see COMMANDS_MODULE)
@@ -0,0 +1,53 @@
+# scrapy dead_letters - list the dead-letter store, or re-crawl its entries
+#
+# Without options this prints what is pending; --replay runs
+# phhc_case_form_dynamic with -a replay=1, which only re-sends the pending
+# entries, under DEAD_LETTER_REPLAY_SETTINGS.
+
+import os
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ..deadletter import DeadLetterStore
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+
+    spider_name = "phhc_case_form_dynamic"
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "List failed search units, or re-crawl only those units (--replay)"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--replay", action="store_true",
+                            help="re-crawl the pending entries instead of listing them")
+        parser.add_argument("--state", default="pending",
+                            help="entries to list: pending, resolved, failed or all (default: pending)")
+        parser.add_argument("-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+                            help="spider argument for the replay crawl (may be repeated)")
+
+    def run(self, args, opts):
+        path = self.settings.get('DEAD_LETTER_PATH', 'dead_letters.sqlite3')
+        if not os.path.exists(path):
+            raise UsageError(f"No dead-letter store at {path}")
+
+        if opts.replay:
+            spider_args = dict(pair.partition('=')[::2] for pair in opts.spargs)
+            self.crawler_process.crawl(self.spider_name, replay='1', **spider_args)
+            self.crawler_process.start()
+            return
+
+        store = DeadLetterStore(path)
+        print(f"{path}: {store.counts()}")
+        state = None if opts.state == 'all' else opts.state
+        for entry_id, case_type, start, end, page, error, attempts, status, replays, entry_state in store.entries(state):
+            failed = f"{error}" + (f" (HTTP {status})" if status else "")
+            print(f"{entry_id:>6}  {entry_state:<8} {case_type:<12} {start} .. {end}  page {page:<3} "
+                  f"{failed:<32} attempts={attempts} replays={replays}")
+        store.close()
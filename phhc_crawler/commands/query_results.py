@@ -0,0 +1,79 @@
+# scrapy query_results - look up rows in the SQLite results database
+#
+# Filters map to indexed columns (case type, decision date, case number)
+# and to the FTS5 index over the row text, e.g.
+#   scrapy query_results --case-type CRM-M --from 2024-03-01 --to 2024-03-31 --text "bail"
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ..resultstore import ResultStore, parse_date
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Query the results database (RESULTS_DB_PATH) by case type, date, case number or text"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--db", default=None, help="results database (default: RESULTS_DB_PATH)")
+        parser.add_argument("--case-type", default=None)
+        parser.add_argument("--from", dest="date_from", default=None, metavar="DATE",
+                            help="earliest decision date (DD/MM/YYYY or YYYY-MM-DD)")
+        parser.add_argument("--to", dest="date_to", default=None, metavar="DATE",
+                            help="latest decision date (DD/MM/YYYY or YYYY-MM-DD)")
+        parser.add_argument("--case-no", default=None, help="exact case number")
+        parser.add_argument("--text", default=None,
+                            help='full-text search over the row\'s columns: rows containing every word or "quoted phrase"')
+        parser.add_argument("--limit", type=int, default=100, help="maximum rows (0: no limit)")
+        parser.add_argument("--format", choices=("table", "json", "csv"), default="table")
+
+    def run(self, args, opts):
+        path = opts.db or self.settings.get('RESULTS_DB_PATH', 'results.sqlite3')
+        if not os.path.exists(path):
+            raise UsageError(f"No results database at {path}")
+        dates = {}
+        for name in ('date_from', 'date_to'):
+            value = getattr(opts, name)
+            if value:
+                dates[name] = parse_date(value)
+                if dates[name] is None:
+                    raise UsageError(f"Unrecognized date: {value}")
+
+        store = ResultStore(path)
+        try:
+            rows = store.query(case_type=opts.case_type, case_no=opts.case_no, text=opts.text,
+                               limit=opts.limit, **dates)
+        except sqlite3.OperationalError as e:
+            raise UsageError(f"Invalid query: {e}")
+        finally:
+            store.close()
+
+        if opts.format == 'json':
+            for row in rows:
+                print(json.dumps(row, ensure_ascii=False))
+        elif opts.format == 'csv':
+            headers = list(dict.fromkeys(header for row in rows for header in row['columns']))
+            writer = csv.writer(sys.stdout)
+            writer.writerow(['case_type', 'decision_date'] + headers + ['links'])
+            for row in rows:
+                writer.writerow([row['case_type'], row['decision_date']]
+                                + [row['columns'].get(header, '') for header in headers]
+                                + [' '.join(row['links'])])
+        else:
+            for row in rows:
+                summary = ' | '.join(f"{header}: {value}" for header, value in row['columns'].items() if value)
+                print(f"{row['case_type'] or '':<10} {row['decision_date'] or row['date'] or '':<10}  {summary}")
+            print(f"({len(rows)} rows)", file=sys.stderr)
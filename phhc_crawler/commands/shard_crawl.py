@@ -0,0 +1,261 @@
+# scrapy shard_crawl - run phhc_case_form_dynamic as N leasing worker processes
+#
+# The (case_type x date window) space is written to a durable SQLite work
+# queue, N worker crawls lease units from it (see workqueue.py), dead
+# workers are replaced and their leases released, and the per-shard CSV
+# feeds are merged into one de-duplicated result file at the end.
+#
+# Workers run in shards/worker-N but share the SQLite stores that only use
+# short transactions: the crawl ledger, the results database and the
+# dead-letter store (SHARED_PATH_SETTINGS, resolved against the directory
+# shard_crawl runs in). Excel workbooks, the Parquet dataset, the dedup
+# index, order documents, logs and metrics snapshots stay per shard. Each
+# worker serves /metrics on a free port of its own (logged in its crawl.log).
+#
+# The case types are read off the search form by a one-request crawl in the
+# coordinator, through the project's downloader middlewares, so the replay
+# archive, the HTTP cache and the session pool apply to it as well. With
+# --spider-arg incremental=1, days the shared ledger has as complete (and
+# older than LEDGER_RECHECK_DAYS) are left out of the queued units.
+
+import csv
+import datetime
+import glob
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+import scrapy
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ..dedup import MemoryDedupStore
+from ..extractors import parse_search_form
+from ..ledger import CrawlLedger
+from ..planner import DateWindow, QueryPlanner
+from ..workqueue import WorkQueue
+
+SHARED_PATH_SETTINGS = ('LEDGER_PATH', 'RESULTS_DB_PATH', 'DEAD_LETTER_PATH')
+
+
+class CaseTypeSpider(scrapy.Spider):
+    """Fetches the search form once and collects its case types into ``case_types``"""
+
+    name = "phhc_case_types"
+    # Only the downloader side of the project is wanted here
+    custom_settings = {
+        'ITEM_PIPELINES': {},
+        'FEEDS': {},
+        'METRICS_ENABLED': False,
+    }
+
+    def __init__(self, start_url, case_types, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Also the session pool's warm-up URL
+        self.start_url = start_url
+        self.case_types = case_types
+
+    def start_requests(self):
+        yield scrapy.Request(self.start_url, callback=self.parse, dont_filter=True)
+
+    def parse(self, response):
+        self.case_types.extend(parse_search_form(response.selector))
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    spider_name = "phhc_case_form_dynamic"
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Run a sharded crawl with N worker processes leasing work units"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 2,
+                            help="number of worker crawler processes (default: CPU count)")
+        parser.add_argument("--queue", default="work_queue.sqlite3",
+                            help="work queue database; an existing queue is resumed")
+        parser.add_argument("--shards-dir", default="shards",
+                            help="directory for per-worker output and logs")
+        parser.add_argument("--output", default="results_merged.csv",
+                            help="merged CSV of all shard feeds")
+        parser.add_argument("--case-types", default=None,
+                            help="comma-separated case types (default: read from the search form)")
+        parser.add_argument("--window-days", type=int, default=None,
+                            help="days per work unit (default: PLANNER_INITIAL_WINDOW_DAYS)")
+        parser.add_argument("--spider-arg", action="append", default=[], metavar="NAME=VALUE",
+                            help="spider argument passed to every worker (may be repeated)")
+        parser.add_argument("--max-restarts", type=int, default=10,
+                            help="how many times dead workers may be replaced in total")
+
+    def run(self, args, opts):
+        if opts.workers < 1:
+            raise UsageError("--workers must be at least 1")
+
+        queue_path = os.path.abspath(opts.queue)
+        queue = WorkQueue(queue_path, max_attempts=self.settings.getint('SHARD_MAX_ATTEMPTS', 3))
+        if not queue.counts():
+            units = self.plan_units(self.case_types(opts), opts)
+            queue.populate(units)
+            print(f"Queued {len(units)} work units in {queue_path}")
+        else:
+            print(f"Resuming work queue {queue_path}: {queue.counts()}")
+
+        self.run_workers(queue, queue_path, opts)
+        print(f"Work queue finished: {queue.counts()}")
+        queue.close()
+
+        rows = self.merge_shards(opts.shards_dir, opts.output)
+        print(f"Merged {rows} rows into {opts.output}")
+
+    @staticmethod
+    def spider_args(opts):
+        return dict(pair.partition('=')[::2] for pair in opts.spider_arg)
+
+    def case_types(self, opts):
+        if opts.case_types:
+            return [ct.strip() for ct in opts.case_types.split(',') if ct.strip()]
+        spidercls = self.crawler_process.spider_loader.load(self.spider_name)
+        url = self.spider_args(opts).get('start_url', spidercls.start_url)
+        # The reactor cannot be restarted, but the workers are processes of their own
+        case_types = []
+        self.crawler_process.crawl(CaseTypeSpider, start_url=url, case_types=case_types)
+        self.crawler_process.start()
+        if not case_types:
+            log = self.settings.get('LOG_FILE') or 'the crawl log'
+            raise UsageError(f"No case types found at {url} (see {log}, or pass --case-types)")
+        return case_types
+
+    def completed_days(self, planner, case_types):
+        """{case_type: days} the ledger has as complete, as an incremental crawl skips them"""
+        recheck_days = self.settings.getint('LEDGER_RECHECK_DAYS', 7)
+        cutoff = planner.end - datetime.timedelta(days=recheck_days - 1)
+        ledger = CrawlLedger.from_settings(self.settings)
+        try:
+            completed = {case_type: ledger.completed_days(case_type, cutoff) for case_type in case_types}
+        finally:
+            ledger.close()
+        print(f"Incremental crawl: skipping {sum(map(len, completed.values()))} completed days, "
+              f"re-checking days from {cutoff:%d/%m/%Y}")
+        return completed
+
+    def plan_units(self, case_types, opts):
+        planner = QueryPlanner.from_settings(self.settings)
+        window_days = opts.window_days or planner.initial_days
+        spidercls = self.crawler_process.spider_loader.load(self.spider_name)
+        completed = {}
+        if spidercls.is_flag(self.spider_args(opts).get('incremental')):
+            completed = self.completed_days(planner, case_types)
+        one_day = datetime.timedelta(days=1)
+        units = []
+        for case_type in case_types:
+            skipped = completed.get(case_type, ())
+            start = planner.start
+            while start <= planner.end:
+                if start in skipped:
+                    start += one_day
+                    continue
+                # Units stop short of the next completed day
+                end = start
+                last = min(start + datetime.timedelta(days=window_days - 1), planner.end)
+                while end < last and end + one_day not in skipped:
+                    end += one_day
+                units.append((case_type, DateWindow(start, end, False)))
+                start = end + one_day
+        return units
+
+    def spawn(self, name, queue_path, opts):
+        workdir = os.path.join(opts.shards_dir, name)
+        os.makedirs(workdir, exist_ok=True)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+        command = [
+            sys.executable, '-m', 'scrapy', 'crawl', self.spider_name,
+            '-a', f'queue={queue_path}',
+            '-a', f'worker={name}',
+        ]
+        for pair in opts.spider_arg:
+            command += ['-a', pair]
+        for setting, value in self.worker_settings().items():
+            command += ['-s', f'{setting}={value}']
+        # Given after the shared settings, so explicit -s options win
+        for pair in opts.set:
+            command += ['-s', pair]
+        print(f"Starting {name} in {workdir}")
+        return subprocess.Popen(command, cwd=workdir, env=env)
+
+    def worker_settings(self):
+        """Settings every worker gets: shared store paths and its own metrics port"""
+        overrides = {
+            name: os.path.abspath(self.settings.get(name))
+            for name in SHARED_PATH_SETTINGS if self.settings.get(name)
+        }
+        # Short ledger transactions, so workers do not wait on each other's locks
+        overrides['LEDGER_COMMIT_EVERY'] = 1
+        # Port 0: any free port, instead of N workers competing for one range
+        overrides['METRICS_HTTP_PORT'] = 0
+        return overrides
+
+    def run_workers(self, queue, queue_path, opts):
+        # Every incarnation gets its own shard directory so a replacement
+        # never overwrites the feed written by the worker it replaces
+        incarnation = 0
+        workers = {}
+        for _ in range(opts.workers):
+            incarnation += 1
+            name = f"worker-{incarnation:03d}"
+            workers[name] = self.spawn(name, queue_path, opts)
+
+        restarts = 0
+        while workers:
+            time.sleep(1)
+            for name, process in list(workers.items()):
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                del workers[name]
+                queue.release_worker(name)
+                if returncode != 0:
+                    print(f"{name} exited with code {returncode}")
+                if not queue.is_finished() and restarts < opts.max_restarts and len(workers) < opts.workers:
+                    if returncode == 0 and workers:
+                        # A clean exit with other workers still running: they will finish the queue
+                        continue
+                    restarts += 1
+                    incarnation += 1
+                    replacement = f"worker-{incarnation:03d}"
+                    workers[replacement] = self.spawn(replacement, queue_path, opts)
+
+    def merge_shards(self, shards_dir, output):
+        """Merge every shard's CSV feed, dropping rows repeated by re-leased units"""
+        feed_name = next(iter(self.settings.getdict('FEEDS')), 'results_backup.csv')
+        paths = sorted(glob.glob(os.path.join(shards_dir, '*', feed_name)))
+
+        fieldnames = []
+        for path in paths:
+            with open(path, newline='', encoding='utf-8') as f:
+                for name in next(csv.reader(f), []):
+                    if name not in fieldnames:
+                        fieldnames.append(name)
+
+        seen = MemoryDedupStore()
+        rows = 0
+        with open(output, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=fieldnames)
+            writer.writeheader()
+            for path in paths:
+                with open(path, newline='', encoding='utf-8') as f:
+                    for row in csv.DictReader(f):
+                        key = hashlib.blake2b(repr(sorted(row.items())).encode('utf-8'), digest_size=8)
+                        if not seen.add(int.from_bytes(key.digest(), 'little', signed=True)):
+                            continue
+                        writer.writerow(row)
+                        rows += 1
+        return rows
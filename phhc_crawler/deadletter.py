@@ -0,0 +1,114 @@
+# Durable dead-letter store for failed search requests
+#
+# A search (or result page) request that still fails after RETRY_TIMES
+# retries - a timeout, a connection error or an HTTP error status - would
+# leave its (case_type, date window) slice missing from the output. The
+# spider's errback records it here instead, with the request itself, the
+# error class, the attempt count and the last HTTP status. A replay run
+# (scrapy crawl ... -a replay=1, or scrapy dead_letters --replay) re-sends
+# only the pending entries, with DEAD_LETTER_REPLAY_SETTINGS applied.
+
+import datetime
+import sqlite3
+import time
+
+from scrapy.spidermiddlewares.httperror import HttpError
+
+from .planner import DateWindow
+
+
+class DeadLetterStore:
+    """SQLite-backed store of failed (case_type, date window, page) requests"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            id          INTEGER PRIMARY KEY,
+            case_type   TEXT    NOT NULL,
+            from_date   TEXT    NOT NULL,
+            to_date     TEXT    NOT NULL,
+            page        INTEGER NOT NULL,
+            method      TEXT    NOT NULL,
+            url         TEXT    NOT NULL,
+            body        BLOB    NOT NULL,
+            error       TEXT    NOT NULL,
+            message     TEXT,
+            attempts    INTEGER NOT NULL,
+            last_status INTEGER,
+            replays     INTEGER NOT NULL DEFAULT 0,
+            state       TEXT    NOT NULL DEFAULT 'pending',
+            failed_at   REAL    NOT NULL,
+            resolved_at REAL,
+            UNIQUE (case_type, from_date, to_date, page)
+        )
+    """
+
+    def __init__(self, path, max_replays=3):
+        self.path = path
+        self.max_replays = max_replays
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('DEAD_LETTER_PATH', 'dead_letters.sqlite3'),
+            max_replays=settings.getint('DEAD_LETTER_MAX_REPLAYS', 3),
+        )
+
+    def add(self, request, failure, case_type, window, page=1):
+        """Record a failed request; a unit that fails again keeps one entry"""
+        status = None
+        if failure.check(HttpError):
+            status = failure.value.response.status
+        replay = request.meta.get('dead_letter') is not None
+        self.conn.execute(
+            "INSERT INTO dead_letters (case_type, from_date, to_date, page, method, url, body, "
+            "error, message, attempts, last_status, failed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (case_type, from_date, to_date, page) DO UPDATE SET "
+            "method = excluded.method, url = excluded.url, body = excluded.body, "
+            "error = excluded.error, message = excluded.message, "
+            "attempts = attempts + excluded.attempts, last_status = excluded.last_status, "
+            "replays = replays + ?, "
+            "state = CASE WHEN replays + ? >= ? THEN 'failed' ELSE 'pending' END, "
+            "failed_at = excluded.failed_at, resolved_at = NULL",
+            (case_type, window.start.isoformat(), window.end.isoformat(), page,
+             request.method, request.url, request.body, failure.type.__name__,
+             failure.getErrorMessage()[:500], request.meta.get('retry_times', 0) + 1, status,
+             time.time(), int(replay), int(replay), self.max_replays),
+        )
+
+    def pending(self):
+        """Pending entries as (id, case_type, DateWindow, page, method, url, body)"""
+        rows = self.conn.execute(
+            "SELECT id, case_type, from_date, to_date, page, method, url, body "
+            "FROM dead_letters WHERE state = 'pending' ORDER BY to_date DESC, case_type, page"
+        ).fetchall()
+        return [
+            (entry_id, case_type,
+             DateWindow(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end), False),
+             page, method, url, body)
+            for entry_id, case_type, start, end, page, method, url, body in rows
+        ]
+
+    def resolve(self, entry_id):
+        """Mark an entry as recovered by a replay"""
+        self.conn.execute(
+            "UPDATE dead_letters SET state = 'resolved', resolved_at = ?, replays = replays + 1 "
+            "WHERE id = ? AND state = 'pending'",
+            (time.time(), entry_id),
+        )
+
+    def entries(self, state=None):
+        query = ("SELECT id, case_type, from_date, to_date, page, error, attempts, last_status, "
+                 "replays, state FROM dead_letters")
+        if state:
+            return self.conn.execute(query + " WHERE state = ? ORDER BY id", (state,)).fetchall()
+        return self.conn.execute(query + " ORDER BY id").fetchall()
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM dead_letters GROUP BY state").fetchall())
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,205 @@
+# Duplicate detection stores for DataValidationPipeline
+#
+# Items are reduced to 64-bit digests of their row identity, so memory use
+# is a fixed 8 bytes per slot instead of one Python string per item.
+# DEDUP_BACKEND selects the store:
+#   - MemoryDedupStore: open-addressing hash table in a flat array
+#   - DiskDedupStore:   SQLite index that survives between runs (and can be
+#                       shared by several processes), with an optional
+#                       in-memory Bloom filter in front of it
+
+import hashlib
+import math
+import re
+import sqlite3
+from array import array
+
+
+# Serial-number columns depend on the row's position in the result page, not
+# on the case itself, so they are left out of the fingerprint
+SERIAL_COLUMN_RE = re.compile(r'^\s*(s\.?\s*no\.?|sr\.?(\s*no\.?)?|#)\s*$', re.IGNORECASE)
+
+
+def item_digest(adapter):
+    """64-bit signed digest of a row's identity
+
+    The "View Order" links identify a row uniquely when present; otherwise
+    the non-serial column values are used.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(str(adapter.get('case_type') or '').encode('utf-8'))
+    links = adapter.get('links') or []
+    if links:
+        for link in sorted(links):
+            h.update(b'\x1f' + link.encode('utf-8'))
+    else:
+        columns = adapter.get('columns') or {}
+        for header in sorted(columns):
+            if SERIAL_COLUMN_RE.match(header):
+                continue
+            h.update(b'\x1e' + header.encode('utf-8') + b'\x1f' + str(columns[header]).encode('utf-8'))
+    return int.from_bytes(h.digest(), 'little', signed=True)
+
+
+class BloomFilter:
+    """Bit-array Bloom filter over 64-bit digests (double hashing)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, digest):
+        digest &= 0xFFFFFFFFFFFFFFFF
+        h1 = digest & 0xFFFFFFFF
+        h2 = (digest >> 32) | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, digest):
+        """Set the digest's bits; returns False if any of them was still clear (a definite miss)"""
+        bits = self.bits
+        seen = True
+        for pos in self._positions(digest):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                seen = False
+        return seen
+
+    def __contains__(self, digest):
+        bits = self.bits
+        for pos in self._positions(digest):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class MemoryDedupStore:
+    """In-memory set of 64-bit digests backed by a linear-probing array"""
+
+    EMPTY = 0
+
+    def __init__(self, initial_capacity=1 << 16, max_load=0.6):
+        self.max_load = max_load
+        self.count = 0
+        self.slots = array('q', bytes(8 * self._round_capacity(initial_capacity)))
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(initial_capacity=settings.getint('DEDUP_INITIAL_CAPACITY', 1 << 16))
+
+    @staticmethod
+    def _round_capacity(capacity):
+        return 1 << max(int(capacity - 1).bit_length(), 4)
+
+    def _insert(self, slots, digest):
+        mask = len(slots) - 1
+        pos = digest & mask
+        while True:
+            current = slots[pos]
+            if current == self.EMPTY:
+                slots[pos] = digest
+                return True
+            if current == digest:
+                return False
+            pos = (pos + 1) & mask
+
+    def add(self, digest):
+        """Add a digest; returns False if it was already present"""
+        if digest == self.EMPTY:
+            digest = 1
+        if not self._insert(self.slots, digest):
+            return False
+        self.count += 1
+        if self.count > len(self.slots) * self.max_load:
+            self._grow()
+        return True
+
+    def _grow(self):
+        slots = array('q', bytes(8 * len(self.slots) * 2))
+        for digest in self.slots:
+            if digest != self.EMPTY:
+                self._insert(slots, digest)
+        self.slots = slots
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        pass
+
+
+class DiskDedupStore:
+    """Persistent SQLite digest index, optionally fronted by a Bloom filter
+
+    The filter is negative-only: a digest it has never seen is new, so it
+    skips the index lookup and is written with the next batch. Anything
+    the filter may have seen goes through INSERT OR IGNORE and the index
+    decides. The filter only knows the index as it was at start-up plus
+    this process's own digests, so leave it off (DEDUP_BLOOM_CAPACITY = 0)
+    when several processes share one index.
+    """
+
+    def __init__(self, path, bloom_capacity=0, bloom_error_rate=0.001, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self.pending = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS digests (digest INTEGER PRIMARY KEY)")
+        self.conn.commit()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+        self.bloom = None
+        # Filter misses not written to the index yet
+        self.unwritten = set()
+        if bloom_capacity:
+            self.bloom = BloomFilter(max(bloom_capacity, self.count * 2), bloom_error_rate)
+            for (digest,) in self.conn.execute("SELECT digest FROM digests"):
+                self.bloom.add(digest)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('DEDUP_PATH', 'dedup_index.sqlite3'),
+            bloom_capacity=settings.getint('DEDUP_BLOOM_CAPACITY', 0),
+            bloom_error_rate=settings.getfloat('DEDUP_BLOOM_ERROR_RATE', 0.001),
+            commit_every=settings.getint('DEDUP_COMMIT_EVERY', 1000),
+        )
+
+    def add(self, digest):
+        """Add a digest; returns False if it was already present"""
+        if self.bloom is not None and not self.bloom.add(digest):
+            # A definite miss: no lookup, just queue the row
+            self.unwritten.add(digest)
+            added = True
+        elif digest in self.unwritten:
+            return False
+        else:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO digests VALUES (?)", (digest,))
+            added = cursor.rowcount > 0
+        if added:
+            self.count += 1
+        # An ignored insert opens a transaction too, so it counts towards the commit
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+        return added
+
+    def commit(self):
+        if self.unwritten:
+            # In key order, so the batch touches each index page once
+            self.conn.executemany("INSERT OR IGNORE INTO digests VALUES (?)",
+                                  ((digest,) for digest in sorted(self.unwritten)))
+            self.unwritten.clear()
+        self.conn.commit()
+        self.pending = 0
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,98 @@
+# Single-pass extraction of the PHHC results table
+#
+# Walks table#tables11 once on the already-parsed lxml tree instead of
+# running separate CSS/XPath queries per cell, and yields header-mapped
+# rows together with their "View Order" links. The page parsers at the end
+# take a parsel Selector, so the same code runs on the reactor thread, in
+# parse pool workers (see parsepool.py) and in scrapy shard_crawl.
+
+import re
+
+from .rows import RowColumns, RowSchema
+
+
+ORDER_LINK_RE = re.compile(r"window\.open\('([^']+)'\)")
+
+SEARCH_NEXT_LINK_CSS = 'a:contains("Next")::attr(href), a[title="Next"]::attr(href)'
+JUDGMENT_NEXT_LINK_CSS = "#tables11 > tbody > tr:last-child > td > a:contains('Next')::attr(href)"
+CASE_TYPE_OPTIONS_CSS = 'select[name="t_case_type"] option::attr(value)'
+
+
+def _direct_text(element):
+    """Direct text children of an element, like the ``th::text`` selector"""
+    texts = []
+    if element.text is not None:
+        texts.append(element.text)
+    for child in element:
+        if child.tail is not None:
+            texts.append(child.tail)
+    return texts
+
+
+def _order_links(cell, urljoin):
+    links = []
+    for a in cell.iter('a'):
+        if 'View Order' not in _direct_text(a):
+            continue
+        # lxml's HTML parser lower-cases attribute names (OnClick -> onclick)
+        m = ORDER_LINK_RE.search(a.get('onclick', ''))
+        if m:
+            links.append(urljoin(m.group(1)))
+    return links
+
+
+def extract_result_rows(root, urljoin):
+    """Extract ``(columns, links)`` for every data row of table#tables11
+
+    ``root`` is the lxml root of the page (``response.selector.root``) and
+    ``urljoin`` resolves relative order URLs (``response.urljoin``). Cell
+    text and header keys match the selector-based extraction they replace;
+    ``columns`` is a RowColumns sharing one header schema per page.
+    """
+    headers = []
+    table_rows = []
+    for table in root.iter('table'):
+        if table.get('id') != 'tables11':
+            continue
+        for tr in table.iter('tr'):
+            table_rows.append(tr)
+            for th in tr.iter('th'):
+                headers.extend(_direct_text(th))
+
+    rows = []
+    schema = RowSchema.intern(headers)
+    for tr in table_rows[1:]:  # skip header row
+        values = []
+        links = []
+        for cell in tr.iter('td'):
+            values.append(next(cell.itertext(), '').strip())
+            links.extend(_order_links(cell, urljoin))
+        if len(values) == len(schema) and len(schema.index) == len(schema):
+            columns = RowColumns(schema, values)
+        else:
+            # Ragged row or repeated headers: key the cells the slow way
+            columns = RowColumns.from_pairs(
+                (headers[i] if i < len(headers) else f'col_{i}', value) for i, value in enumerate(values)
+            )
+        rows.append((columns, links))
+    return rows
+
+
+def parse_search_page(selector, urljoin):
+    """``(rows, next_href)`` of a case search result page"""
+    rows = extract_result_rows(selector.root, urljoin)
+    return rows, selector.css(SEARCH_NEXT_LINK_CSS).get()
+
+
+def parse_judgment_page(selector, urljoin):
+    """``(rows, next_href)`` of a judgment search page; rows are lists of cell texts"""
+    rows = [
+        [td.xpath('string(.)').get().strip() for td in row.css('td')]
+        for row in selector.css('table#tables11 tr')[1:]  # skip header
+    ]
+    return rows, selector.css(JUDGMENT_NEXT_LINK_CSS).get()
+
+
+def parse_search_form(selector):
+    """Case types offered by the search form, without the empty placeholder option"""
+    return [ct for ct in selector.css(CASE_TYPE_OPTIONS_CSS).getall() if ct.strip() != '']
@@ -0,0 +1,121 @@
+# External merge sort for CSV exports
+#
+# Rows are buffered up to run_size, sorted and spilled to a run file as the
+# crawl goes, so memory is bounded by one run. Runs are kept in levels:
+# max_fan_in runs of one level are merged into a single run of the next, so
+# every row is rewritten once per level (O(n log n) I/O) while the number of
+# open files stays bounded. Finishing the export is a streaming k-way merge
+# of the remaining runs into the final CSV.
+
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+
+
+class ExternalSortWriter:
+    """Sorts dict rows into a CSV file using sorted run files on disk"""
+
+    def __init__(self, fieldnames, key, run_size=50000, tmp_dir=None, max_fan_in=64):
+        self.fieldnames = list(fieldnames)
+        self.key = key
+        self.run_size = run_size
+        self.max_fan_in = max_fan_in
+        self.tmp_dir = tempfile.mkdtemp(prefix='sort-runs-', dir=tmp_dir)
+        self.buffer = []
+        # levels[i]: runs that each hold max_fan_in ** i spills, oldest first
+        self.levels = []
+        self.row_count = 0
+        self.run_sequence = 0
+
+    @property
+    def runs(self):
+        """All run files in arrival order (higher levels hold older rows)"""
+        return [path for level in reversed(self.levels) for path in level]
+
+    def add(self, row):
+        self.buffer.append(row)
+        self.row_count += 1
+        if len(self.buffer) >= self.run_size:
+            self._spill()
+
+    def _new_run_path(self):
+        self.run_sequence += 1
+        return os.path.join(self.tmp_dir, f'run_{self.run_sequence:06d}.csv')
+
+    def _spill(self):
+        """Sort the buffered rows and write them out as a run"""
+        if not self.buffer:
+            return
+        self.buffer.sort(key=self.key)
+        path = self._new_run_path()
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+            writer.writerows(self.buffer)
+        self.buffer = []
+        self._add_run(path, 0)
+
+    def _add_run(self, path, level):
+        # Keep the number of open files in the final merge bounded by
+        # merging a full level into one run of the next while the crawl is
+        # still going
+        while True:
+            if len(self.levels) <= level:
+                self.levels.append([])
+            runs = self.levels[level]
+            runs.append(path)
+            if len(runs) < self.max_fan_in:
+                return
+            path = self._new_run_path()
+            self._merge(runs, path, header=False)
+            self.levels[level] = []
+            level += 1
+
+    def _read_run(self, f):
+        return csv.DictReader(f, fieldnames=self.fieldnames)
+
+    def _merge(self, run_paths, output_path, header):
+        files = [open(path, newline='', encoding='utf-8') for path in run_paths]
+        try:
+            with open(output_path, 'w', newline='', encoding='utf-8') as out:
+                writer = csv.DictWriter(out, fieldnames=self.fieldnames)
+                if header:
+                    writer.writeheader()
+                # heapq.merge is stable across runs, so ties keep arrival order
+                writer.writerows(heapq.merge(*(self._read_run(f) for f in files), key=self.key))
+        finally:
+            for f in files:
+                f.close()
+        for path in run_paths:
+            os.remove(path)
+
+    def finish(self, output_path):
+        """Merge all runs into ``output_path`` and remove the run files"""
+        try:
+            if self.levels:
+                self._spill()
+                runs = self.runs
+                while len(runs) > self.max_fan_in:
+                    # Merge the newest runs first; merged runs keep their
+                    # place so ties still keep arrival order
+                    merged_path = self._new_run_path()
+                    self._merge(runs[-self.max_fan_in:], merged_path, header=False)
+                    runs = runs[:-self.max_fan_in] + [merged_path]
+                self._merge(runs, output_path, header=True)
+            else:
+                # Everything fitted in one run: no need to touch the disk twice
+                self.buffer.sort(key=self.key)
+                with open(output_path, 'w', newline='', encoding='utf-8') as out:
+                    writer = csv.DictWriter(out, fieldnames=self.fieldnames)
+                    writer.writeheader()
+                    writer.writerows(self.buffer)
+                self.buffer = []
+        finally:
+            self.close()
+
+    def close(self):
+        """Remove the run files (also when the export was never finished)"""
+        self.buffer = []
+        self.levels = []
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
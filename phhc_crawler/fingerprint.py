@@ -0,0 +1,50 @@
+# Request fingerprints that treat equivalent form submissions as equal
+#
+# The PHHC search is a POST form, so the default fingerprint (URL + raw body)
+# depends on the order formdata fields were encoded in. Canonicalizing the
+# url-encoded body makes the fingerprint depend only on the submitted values.
+
+import hashlib
+from urllib.parse import parse_qsl, urlencode
+from weakref import WeakKeyDictionary
+
+from w3lib.url import canonicalize_url
+
+
+def canonical_form_body(request):
+    """Request body with url-encoded form fields sorted"""
+    body = request.body or b''
+    if body and request.headers.get('Content-Type', b'').startswith(b'application/x-www-form-urlencoded'):
+        pairs = sorted(parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True))
+        body = urlencode(pairs).encode('utf-8')
+    return body
+
+
+def canonical_request_key(request):
+    """Stable key for a request: method, canonical URL and sorted form body
+
+    FormRequest bodies are url-encoded, so two submissions of the same
+    formdata in a different field order map to the same key.
+    """
+    body = canonical_form_body(request)
+    digest = hashlib.sha1()
+    digest.update(request.method.encode('ascii') + b' ')
+    digest.update(canonicalize_url(request.url).encode('utf-8') + b'\n')
+    digest.update(body)
+    return digest.hexdigest(), body
+
+
+class FormRequestFingerprinter:
+    """REQUEST_FINGERPRINTER_CLASS keyed on canonical_request_key()"""
+
+    def __init__(self):
+        self.cache = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls()
+
+    def fingerprint(self, request):
+        if request not in self.cache:
+            self.cache[request] = bytes.fromhex(canonical_request_key(request)[0])
+        return self.cache[request]
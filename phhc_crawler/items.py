@@ -3,11 +3,84 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+from collections.abc import KeysView
+
 import scrapy
+from itemadapter import ItemAdapter
+from itemadapter.adapter import AdapterInterface
 
 
 class PhhcCrawlerItem(scrapy.Item):
     case_type = scrapy.Field()
     date = scrapy.Field()
+    date_range = scrapy.Field()  # "from-to" search window, when date is only its start
     columns = scrapy.Field()  # Dictionary of column_name: value
     links = scrapy.Field()    # List of URLs in the row
+    order_files = scrapy.Field()  # List of {url, path, sha256, size} for downloaded orders
+
+
+class CaseRowItem:
+    """Slotted item for one search result row
+
+    ``columns`` is a RowColumns (one header schema shared by the whole page)
+    and ``links`` a tuple, so a row costs a handful of references instead of
+    an Item dict plus a columns dict. Pipelines and feed exporters read it
+    through ItemAdapter (CaseRowItemAdapter below).
+    """
+
+    # Alphabetical, like scrapy.Item fields, so export column order is unchanged
+    __slots__ = ('case_type', 'columns', 'date', 'date_range', 'links', 'order_files')
+
+    def __init__(self, case_type=None, date=None, columns=None, links=(), order_files=None, date_range=None):
+        self.case_type = case_type
+        self.date = date
+        self.date_range = date_range
+        self.columns = columns
+        self.links = tuple(links)
+        self.order_files = order_files
+
+    def __repr__(self):
+        return f"CaseRowItem(case_type={self.case_type!r}, date={self.date!r}, columns={self.columns!r})"
+
+
+class CaseRowItemAdapter(AdapterInterface):
+    """ItemAdapter support for CaseRowItem; unset (None) fields count as missing"""
+
+    fields = CaseRowItem.__slots__
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, CaseRowItem)
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(cls.fields)
+
+    def field_names(self):
+        return KeysView(dict.fromkeys(self.fields))
+
+    def __getitem__(self, field_name):
+        if field_name in self.fields:
+            value = getattr(self.item, field_name)
+            if value is not None:
+                return value
+        raise KeyError(field_name)
+
+    def __setitem__(self, field_name, value):
+        if field_name not in self.fields:
+            raise KeyError(f"CaseRowItem does not support field: {field_name}")
+        setattr(self.item, field_name, value)
+
+    def __delitem__(self, field_name):
+        if field_name not in self.fields or getattr(self.item, field_name) is None:
+            raise KeyError(field_name)
+        setattr(self.item, field_name, None)
+
+    def __iter__(self):
+        return (field for field in self.fields if getattr(self.item, field) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+ItemAdapter.ADAPTER_CLASSES.appendleft(CaseRowItemAdapter)
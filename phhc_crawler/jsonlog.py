@@ -0,0 +1,200 @@
+# Queue-based, sampled JSON-lines logging (LOG_QUEUE_ENABLED)
+#
+# While the engine runs, QueueLogging swaps Scrapy's root log handler for a
+# QueueHandler: the reactor thread only filters and enqueues records, and a
+# QueueListener thread formats them as JSON lines into LOG_JSON_FILE (and,
+# with LOG_QUEUE_TEXT_LOG, hands them to the usual text handler as well).
+#
+# Log calls tagged with extra={'event': ..., 'case_type': ...} are counted
+# per event and case type, sampled (LOG_SAMPLE_RATES) and rate limited
+# (LOG_RATE_LIMITS, events per second). Instead of one line per event, a
+# log_summary record with the counts is written every LOG_SUMMARY_INTERVAL
+# seconds and when the crawl stops.
+
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from collections import defaultdict
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.log import get_scrapy_root_handler
+from twisted.internet.task import LoopingCall
+
+logger = logging.getLogger(__name__)
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record, with extra= fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class EventSampler(logging.Filter):
+    """Counts tagged events and lets through only a sample of them
+
+    ``sample_rates`` maps an event to the share of its records that is
+    logged (every 1/rate-th, starting with the first); ``rate_limits``
+    caps an event at that many records per second. Untagged records and
+    events without a rule always pass.
+
+    The filter also applies the log level (``level``), after counting, so
+    events below it (e.g. DEBUG row events at LOG_LEVEL=INFO) are still
+    counted in the summary without being written.
+    """
+
+    def __init__(self, sample_rates=None, rate_limits=None, level=logging.NOTSET):
+        super().__init__()
+        self.level = level
+        self.sample_every = {
+            event: (max(1, round(1 / rate)) if rate > 0 else 0)
+            for event, rate in (sample_rates or {}).items()
+        }
+        self.rate_limits = dict(rate_limits or {})
+        # {event: [tokens, last refill]}
+        self.buckets = {}
+        # {event: {case_type: count}}
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self.totals = defaultdict(int)
+        self.suppressed = defaultdict(int)
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is not None:
+            self.counts[event][getattr(record, 'case_type', '')] += 1
+            self.totals[event] += 1
+        if record.levelno < self.level:
+            return False
+        if event is None:
+            return True
+        every = self.sample_every.get(event)
+        if every is not None:
+            if not every or (self.totals[event] - 1) % every:
+                self.suppressed[event] += 1
+                return False
+        limit = self.rate_limits.get(event)
+        if limit:
+            now = time.monotonic()
+            bucket = self.buckets.setdefault(event, [float(limit), now])
+            bucket[0] = min(float(limit), bucket[0] + (now - bucket[1]) * limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.suppressed[event] += 1
+                return False
+            bucket[0] -= 1
+        return True
+
+    def summary(self):
+        return {
+            'counts': {event: dict(by_case_type) for event, by_case_type in self.counts.items()},
+            'suppressed': dict(self.suppressed),
+        }
+
+
+class QueueLogging:
+    """Extension moving log formatting and file I/O to a listener thread"""
+
+    def __init__(self, crawler, json_file, text_log=True, sample_rates=None, rate_limits=None,
+                 summary_interval=60.0):
+        self.crawler = crawler
+        self.json_file = json_file
+        self.text_log = text_log
+        self.summary_interval = summary_interval
+        self.sampler = EventSampler(sample_rates, rate_limits)
+        self.handler = None
+        self.listener = None
+        self.replaced = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('LOG_QUEUE_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            settings.get('LOG_JSON_FILE', 'crawl.jsonl'),
+            text_log=settings.getbool('LOG_QUEUE_TEXT_LOG', True),
+            sample_rates={event: float(rate) for event, rate in settings.getdict('LOG_SAMPLE_RATES').items()},
+            rate_limits={event: float(limit) for event, limit in settings.getdict('LOG_RATE_LIMITS').items()},
+            summary_interval=settings.getfloat('LOG_SUMMARY_INTERVAL', 60.0),
+        )
+        # The root handler is (re)installed after extensions are built, so
+        # it is only swapped once the engine is running
+        crawler.signals.connect(ext.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        return ext
+
+    def engine_started(self):
+        json_handler = logging.FileHandler(self.json_file, encoding='utf-8')
+        json_handler.setFormatter(JsonLinesFormatter())
+        targets = [json_handler]
+
+        root = logging.getLogger()
+        self.replaced = get_scrapy_root_handler()
+        if self.replaced is not None:
+            root.removeHandler(self.replaced)
+            if self.text_log:
+                targets.append(self.replaced)
+
+        records = queue.SimpleQueue()
+        self.handler = logging.handlers.QueueHandler(records)
+        # The level is checked by the sampler once it has counted the record
+        self.sampler.level = self.replaced.level if self.replaced is not None else logging.NOTSET
+        self.handler.addFilter(self.sampler)
+        self.listener = logging.handlers.QueueListener(records, *targets, respect_handler_level=True)
+        self.listener.start()
+        root.addHandler(self.handler)
+
+        self.task = LoopingCall(self.log_summary)
+        self.task.start(self.summary_interval, now=False)
+        logger.info("Queue logging to %s (sampled events: %s)", self.json_file,
+                    sorted(self.sampler.sample_every) or 'none')
+
+    def log_summary(self):
+        summary = self.sampler.summary()
+        if summary['counts']:
+            logger.info("Log event counts: %s", summary['counts'], extra={'log_summary': summary})
+
+    def spider_closed(self, spider):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.log_summary()
+        for event, total in self.sampler.totals.items():
+            self.crawler.stats.set_value(f'log/events/{event}', total)
+        for event, suppressed in self.sampler.suppressed.items():
+            self.crawler.stats.set_value(f'log/suppressed/{event}', suppressed)
+
+    def engine_stopped(self):
+        if self.handler is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        # Drains the queue before returning
+        self.listener.stop()
+        for target in self.listener.handlers:
+            if target is not self.replaced:
+                target.close()
+        if self.replaced is not None:
+            root.addHandler(self.replaced)
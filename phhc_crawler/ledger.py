@@ -0,0 +1,89 @@
+# Durable work ledger for incremental crawls
+#
+# Every parsed result page of a (case_type, date window) search is recorded
+# in a small SQLite database next to crawl.log. A window counts as complete
+# once its last page has been recorded; incremental runs skip days covered
+# by complete windows and only re-check the most recent days.
+
+import datetime
+import sqlite3
+import time
+
+
+class CrawlLedger:
+    """SQLite-backed record of completed (case_type, date window, page) units"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS units (
+            case_type   TEXT    NOT NULL,
+            from_date   TEXT    NOT NULL,
+            to_date     TEXT    NOT NULL,
+            page        INTEGER NOT NULL,
+            row_count   INTEGER NOT NULL,
+            complete    INTEGER NOT NULL,
+            finished_at REAL    NOT NULL,
+            PRIMARY KEY (case_type, from_date, to_date, page)
+        )
+    """
+
+    def __init__(self, path, commit_every=50):
+        self.path = path
+        self.commit_every = commit_every
+        self.pending = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+        self.conn.commit()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('LEDGER_PATH', 'crawl_state.sqlite3'),
+            commit_every=settings.getint('LEDGER_COMMIT_EVERY', 50),
+        )
+
+    def record(self, case_type, window, page, row_count, complete):
+        """Record a parsed result page; ``complete`` marks the window's last page"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (case_type, window.start.isoformat(), window.end.isoformat(),
+             page, row_count, int(complete), time.time()),
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def completed_days(self, case_type, before):
+        """Set of days older than ``before`` covered by complete windows"""
+        rows = self.conn.execute(
+            "SELECT from_date, to_date FROM units "
+            "WHERE case_type = ? AND complete = 1 AND to_date < ?",
+            (case_type, before.isoformat()),
+        )
+        days = set()
+        for from_date, to_date in rows:
+            day = datetime.date.fromisoformat(from_date)
+            last = datetime.date.fromisoformat(to_date)
+            while day <= last:
+                days.add(day)
+                day += datetime.timedelta(days=1)
+        return days
+
+    def yields(self):
+        """{case_type: (rows, days)} over all complete windows"""
+        rows = self.conn.execute(
+            "SELECT case_type, SUM(rows), SUM(days) FROM ("
+            "  SELECT case_type, SUM(row_count) AS rows,"
+            "         julianday(to_date) - julianday(from_date) + 1 AS days"
+            "  FROM units GROUP BY case_type, from_date, to_date HAVING MAX(complete) = 1"
+            ") GROUP BY case_type"
+        )
+        return {case_type: (int(total_rows), int(total_days)) for case_type, total_rows, total_days in rows}
+
+    def flush(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,337 @@
+# Per-dimension crawl metrics
+#
+# CrawlMetrics keeps fixed-bucket histograms of download latency, response
+# size, parse time and items per response, split by case type and by search
+# date, counts "refine your query" pages, and samples scheduler, downloader
+# and scraper queue depths. Every METRICS_INTERVAL seconds a snapshot is
+# appended to METRICS_SNAPSHOT_FILE (JSON lines), and the same numbers are
+# served in the Prometheus text format on 127.0.0.1 (METRICS_HTTP_PORT).
+# Parse time and items per response are measured by ParseTimingMiddleware.
+
+import bisect
+import json
+import time
+from collections import defaultdict
+
+from scrapy import Request, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.reactor import listen_tcp
+from twisted.internet.task import LoopingCall
+from twisted.web import resource, server
+
+from .httpcache import search_params, search_start_date
+
+# Custom signal: sent by ParseTimingMiddleware once a callback's output is consumed
+response_parsed = object()
+
+REFINE_MARKER = b'refine your query'
+CASE_TYPE_FIELDS = ('t_case_type', 'ctype')
+
+HISTOGRAM_BUCKETS = {
+    'download_latency_seconds': (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    'response_bytes': (1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+    'parse_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+    'items_per_response': (0, 1, 5, 10, 25, 50, 100, 250, 500),
+}
+COUNTERS = ('responses_total', 'items_total', 'refine_hits_total')
+
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus-style upper bounds"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None when empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+def request_dimensions(request):
+    """(case_type, search date) of a search request; ('', '') for other pages"""
+    case_type = request.cb_kwargs.get('case_type')
+    params = search_params(request)
+    if case_type is None:
+        case_type = next((params[field] for field in CASE_TYPE_FIELDS if params.get(field)), '')
+    date = search_start_date(params)
+    return str(case_type), date.isoformat() if date else ''
+
+
+class CrawlMetrics:
+    """Stats extension recording per-case-type and per-date crawl metrics"""
+
+    def __init__(self, crawler, interval=30.0, snapshot_file=None, http_ports=None, http_host='127.0.0.1'):
+        self.crawler = crawler
+        self.interval = interval
+        self.snapshot_file = snapshot_file
+        self.http_ports = http_ports
+        self.http_host = http_host
+        # {label name: {label value: {metric: Histogram or int}}}
+        self.dimensions = {
+            'case_type': defaultdict(self._new_series),
+            'date': defaultdict(self._new_series),
+        }
+        self.totals = self._new_series()
+        self.queues = {}
+        self.started = time.time()
+        self.snapshots = None
+        self.listener = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            interval=settings.getfloat('METRICS_INTERVAL', 30.0),
+            snapshot_file=settings.get('METRICS_SNAPSHOT_FILE'),
+            http_ports=settings.getlist('METRICS_HTTP_PORT') or None,
+            http_host=settings.get('METRICS_HTTP_HOST', '127.0.0.1'),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.response_parsed, signal=response_parsed)
+        return ext
+
+    @staticmethod
+    def _new_series():
+        series = {name: Histogram(bounds) for name, bounds in HISTOGRAM_BUCKETS.items()}
+        series.update((name, 0) for name in COUNTERS)
+        return series
+
+    def _series(self, request):
+        case_type, date = request_dimensions(request)
+        series = [self.totals]
+        if case_type:
+            series.append(self.dimensions['case_type'][case_type])
+        if date:
+            series.append(self.dimensions['date'][date])
+        return series
+
+    def spider_opened(self, spider):
+        if self.snapshot_file:
+            self.snapshots = open(self.snapshot_file, 'a', encoding='utf-8')
+        if self.http_ports:
+            root = resource.Resource()
+            root.putChild(b'metrics', PrometheusResource(self))
+            self.listener = listen_tcp([int(port) for port in self.http_ports], self.http_host, server.Site(root))
+            address = self.listener.getHost()
+            spider.logger.info(f"Metrics endpoint: http://{address.host}:{address.port}/metrics")
+        self.task = LoopingCall(self.snapshot)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.snapshot(final=True)
+        if self.snapshots:
+            self.snapshots.close()
+        if self.listener:
+            self.listener.stopListening()
+        totals = self.totals
+        spider.logger.info(
+            f"Crawl metrics - responses: {totals['responses_total']}, items: {totals['items_total']}, "
+            f"refine hits: {totals['refine_hits_total']}, "
+            f"latency p50/p99: {totals['download_latency_seconds'].quantile(0.5)}/"
+            f"{totals['download_latency_seconds'].quantile(0.99)} s"
+        )
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        refine = REFINE_MARKER in response.body.lower()
+        for series in self._series(request):
+            series['responses_total'] += 1
+            series['response_bytes'].observe(len(response.body))
+            if latency is not None:
+                series['download_latency_seconds'].observe(latency)
+            if refine:
+                series['refine_hits_total'] += 1
+
+    def response_parsed(self, response, seconds, items):
+        for series in self._series(response.request):
+            series['parse_seconds'].observe(seconds)
+            series['items_per_response'].observe(items)
+
+    def item_scraped(self, item, response, spider):
+        for series in self._series(response.request):
+            series['items_total'] += 1
+
+    def sample_queues(self):
+        """Current queue depths, from the same places as the telnet est() report"""
+        engine = self.crawler.engine
+        downloader = engine.downloader
+        queues = {
+            'downloader_active': len(downloader.active),
+            'downloader_queued': sum(len(slot.queue) for slot in downloader.slots.values()),
+            'downloader_transferring': sum(len(slot.transferring) for slot in downloader.slots.values()),
+            'scraper_queue': len(engine.scraper.slot.queue),
+            'scraper_active': len(engine.scraper.slot.active),
+        }
+        slot = getattr(engine, '_slot', None)
+        if slot is not None:
+            queues['scheduler'] = len(slot.scheduler)
+            queues['inprogress'] = len(slot.inprogress)
+        return queues
+
+    def snapshot(self, final=False):
+        try:
+            self.queues = self.sample_queues()
+        except AttributeError:
+            # Engine not running (yet, or any more)
+            pass
+        if not self.snapshots:
+            return
+        record = {
+            'time': round(time.time(), 3),
+            'elapsed_sec': round(time.time() - self.started, 3),
+            'final': final,
+            'queues': self.queues,
+            'totals': self._summarize(self.totals),
+            'case_type': {value: self._summarize(series) for value, series in self.dimensions['case_type'].items()},
+            'date': {value: self._summarize(series) for value, series in self.dimensions['date'].items()},
+            'stats': {key: value for key, value in self.crawler.stats.get_stats().items()
+                      if isinstance(value, (int, float)) and not isinstance(value, bool)},
+        }
+        self.snapshots.write(json.dumps(record) + '\n')
+        self.snapshots.flush()
+
+    @staticmethod
+    def _summarize(series):
+        return {
+            name: value.summary() if isinstance(value, Histogram) else value
+            for name, value in series.items()
+        }
+
+    def prometheus_text(self):
+        lines = []
+        for name in COUNTERS:
+            lines.append(f'# TYPE phhc_{name} counter')
+            lines.append(f'phhc_{name} {self.totals[name]}')
+            for label, values in self.dimensions.items():
+                for value, series in values.items():
+                    lines.append(f'phhc_{name}{{{label}="{_escape(value)}"}} {series[name]}')
+        for name, bounds in HISTOGRAM_BUCKETS.items():
+            lines.append(f'# TYPE phhc_{name} histogram')
+            _histogram_lines(lines, f'phhc_{name}', '', self.totals[name])
+            for label, values in self.dimensions.items():
+                for value, series in values.items():
+                    _histogram_lines(lines, f'phhc_{name}', f'{label}="{_escape(value)}"', series[name])
+        lines.append('# TYPE phhc_queue_depth gauge')
+        for queue, depth in self.queues.items():
+            lines.append(f'phhc_queue_depth{{queue="{queue}"}} {depth}')
+        for key, value in self.crawler.stats.get_stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'phhc_stat{{name="{_escape(key)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(lines, name, labels, histogram):
+    prefix = f'{labels},' if labels else ''
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {histogram.sum}')
+    lines.append(f'{name}_count{suffix} {histogram.count}')
+
+
+class PrometheusResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.metrics.prometheus_text().encode('utf-8')
+
+
+class ParseTimingMiddleware:
+    """Spider middleware timing callbacks and counting the items they yield
+
+    Only the time spent inside the callback (and the middlewares below this
+    one) is counted, not the time the engine takes to process its output.
+    For coroutine callbacks (PARSE_POOL_WORKERS) this is wall time and
+    includes waiting for a pool worker; the workers' own parse time is in
+    the spider's "Parse Pool Stats" (worker_cpu_seconds).
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        elapsed = 0.0
+        items = 0
+        iterator = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            if not isinstance(value, Request):
+                items += 1
+            yield value
+        self.crawler.signals.send_catch_log(response_parsed, response=response, seconds=elapsed, items=items)
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed = 0.0
+        items = 0
+        iterator = result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                value = await iterator.__anext__()
+            except StopAsyncIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            if not isinstance(value, Request):
+                items += 1
+            yield value
+        self.crawler.signals.send_catch_log(response_parsed, response=response, seconds=elapsed, items=items)
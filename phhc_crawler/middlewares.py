@@ -3,7 +3,22 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import json
+import sqlite3
+import time
+import zlib
+
+from scrapy import Request, signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.http.cookies import CookieJar
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+from twisted.internet.error import TCPTimedOutError, TimeoutError
+
+from .fingerprint import canonical_request_key
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
@@ -53,48 +68,410 @@ class PhhcCrawlerSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
-class PhhcCrawlerDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+class RecordReplayMiddleware:
+    """Record responses to a local archive, or replay them without the network
+
+    REPLAY_MODE = "record" stores every downloaded response keyed by
+    canonical_request_key(); REPLAY_MODE = "replay" serves requests from
+    that archive and ignores requests it has never seen.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key         TEXT PRIMARY KEY,
+            method      TEXT NOT NULL,
+            url         TEXT NOT NULL,
+            request_body BLOB NOT NULL,
+            status      INTEGER NOT NULL,
+            response_url TEXT NOT NULL,
+            headers     TEXT NOT NULL,
+            body        BLOB NOT NULL,
+            recorded_at REAL NOT NULL
+        )
+    """
+
+    def __init__(self, mode, path, ignore_http_codes=(), commit_every=100, stats=None):
+        self.mode = mode
+        self.path = path
+        self.ignore_http_codes = set(ignore_http_codes)
+        self.commit_every = commit_every
+        self.pending = 0
+        self.stats = stats
+        self.conn = None
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        mode = crawler.settings.get('REPLAY_MODE', 'off').lower()
+        if mode not in ('record', 'replay'):
+            raise NotConfigured
+        s = cls(
+            mode,
+            crawler.settings.get('REPLAY_ARCHIVE', 'replay_archive.sqlite3'),
+            ignore_http_codes=[int(code) for code in crawler.settings.getlist('REPLAY_IGNORE_HTTP_CODES', [429, 500, 502, 503, 504])],
+            commit_every=crawler.settings.getint('REPLAY_COMMIT_EVERY', 100),
+            stats=crawler.stats,
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def spider_opened(self, spider):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+        self.conn.commit()
+        spider.logger.info(f"Record/replay middleware in {self.mode} mode using {self.path}")
+
+    def spider_closed(self, spider):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
+        if self.mode != 'replay':
+            return None
+
+        key, _ = canonical_request_key(request)
+        row = self.conn.execute(
+            "SELECT status, response_url, headers, body FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.stats.inc_value('replay/miss', spider=spider)
+            raise IgnoreRequest(f"No recorded response for {request.method} {request.url}")
+
+        status, url, headers, body = row
+        headers = Headers(json.loads(headers))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        self.stats.inc_value('replay/hit', spider=spider)
+        return respcls(url=url, status=status, headers=headers, body=body, flags=['replayed'])
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+        if self.mode != 'record' or response.status in self.ignore_http_codes:
+            return response
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        key, request_body = canonical_request_key(request)
+        headers = [
+            (name.decode('latin-1'), [value.decode('latin-1') for value in values])
+            for name, values in response.headers.items()
+        ]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, request.method, request.url, request_body, response.status, response.url,
+             json.dumps(headers), zlib.compress(response.body), time.time()),
+        )
+        self.stats.inc_value('replay/recorded', spider=spider)
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+        return response
+
+
+class AIMDConcurrencyMiddleware:
+    """Adjust per-slot download concurrency with additive-increase/multiplicative-decrease
+
+    Every clean response grows the slot's concurrency by 1/limit (about +1
+    per round trip). A backpressure signal - latency well above the
+    observed baseline, a 429/503, a timeout, or a "refine your query" /
+    empty error page - cuts it by AIMD_DECREASE_FACTOR, at most once per
+    AIMD_COOLDOWN seconds. The baseline follows new latency minima at once
+    and drifts up by AIMD_BASELINE_DECAY of the gap per response, so a
+    server that got permanently slower does not read as congested forever.
+    Only 200 responses to non-order requests can count as empty pages. The current limit and the reasons for every
+    decrease are kept in the crawl stats under ``aimd/``.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.min_concurrency = settings.getint('AIMD_MIN_CONCURRENCY', 1)
+        self.max_concurrency = settings.getint('AIMD_MAX_CONCURRENCY', settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'))
+        self.start_concurrency = settings.getint('AIMD_START_CONCURRENCY', 8)
+        self.decrease_factor = settings.getfloat('AIMD_DECREASE_FACTOR', 0.5)
+        self.latency_factor = settings.getfloat('AIMD_LATENCY_FACTOR', 2.0)
+        self.cooldown = settings.getfloat('AIMD_COOLDOWN', 5.0)
+        self.backoff_codes = {int(code) for code in settings.getlist('AIMD_BACKOFF_HTTP_CODES', [429, 503])}
+        self.markers = [marker.lower().encode('utf-8') for marker in settings.getlist('AIMD_BACKOFF_MARKERS', ['refine your query'])]
+        self.min_body_bytes = settings.getint('AIMD_MIN_BODY_BYTES', 0)
+        self.baseline_decay = settings.getfloat('AIMD_BASELINE_DECAY', 0.01)
+        # Per-slot state: {'limit': float, 'latency': EWMA, 'baseline': float, 'last_decrease': ts}
+        self.slots = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('AIMD_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def _slot(self, request):
+        downloader = self.crawler.engine.downloader
+        key = request.meta.get('download_slot') or downloader.get_slot_key(request)
+        state = self.slots.get(key)
+        if state is None:
+            state = self.slots[key] = {
+                'limit': float(self.start_concurrency),
+                'latency': None,
+                'baseline': None,
+                'last_decrease': 0.0,
+            }
+        return key, state
+
+    def _apply(self, key, state):
+        limit = int(state['limit'])
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None and slot.concurrency != limit:
+            slot.concurrency = limit
+        self.stats.set_value(f'aimd/concurrency/{key}', limit)
+        self.stats.max_value(f'aimd/max_concurrency/{key}', limit)
+        self.stats.min_value(f'aimd/min_concurrency/{key}', limit)
+
+    def _increase(self, key, state):
+        state['limit'] = min(state['limit'] + 1.0 / state['limit'], float(self.max_concurrency))
+        self._apply(key, state)
+
+    def _decrease(self, key, state, reason, spider):
+        self.stats.inc_value(f'aimd/backpressure/{reason}')
+        now = time.time()
+        if now - state['last_decrease'] < self.cooldown:
+            return
+        state['last_decrease'] = now
+        previous = int(state['limit'])
+        state['limit'] = max(state['limit'] * self.decrease_factor, float(self.min_concurrency))
+        self.stats.inc_value('aimd/decreases')
+        self._apply(key, state)
+        spider.logger.info(f"AIMD: {reason} on {key}, concurrency {previous} -> {int(state['limit'])}")
+
+    def _backpressure_reason(self, request, response, state):
+        if response.status in self.backoff_codes:
+            return f'http_{response.status}'
+        body = response.body.lower()
+        # Order documents and error statuses are not search result pages
+        if (response.status == 200 and not request.meta.get('order_download')
+                and len(body) < self.min_body_bytes):
+            return 'empty_page'
+        for marker in self.markers:
+            if marker in body:
+                return 'marker'
+
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return None
+        state['latency'] = latency if state['latency'] is None else 0.8 * state['latency'] + 0.2 * latency
+        if state['baseline'] is None or state['latency'] < state['baseline']:
+            state['baseline'] = state['latency']
+        else:
+            state['baseline'] += (state['latency'] - state['baseline']) * self.baseline_decay
+        if state['latency'] > state['baseline'] * self.latency_factor:
+            return 'latency'
+        return None
+
+    def process_request(self, request, spider):
+        key, state = self._slot(request)
+        self._apply(key, state)
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'replayed' in response.flags or 'cached' in response.flags:
+            return response
+        key, state = self._slot(request)
+        reason = self._backpressure_reason(request, response, state)
+        if reason:
+            self._decrease(key, state, reason, spider)
+        else:
+            self._increase(key, state)
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        if isinstance(exception, (TimeoutError, defer.TimeoutError, TCPTimedOutError)):
+            key, state = self._slot(request)
+            self._decrease(key, state, 'timeout', spider)
+        return None
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
 
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+class _Session:
+    __slots__ = ('id', 'jar', 'ready', 'refreshing', 'generation', 'warmed_at')
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.jar = CookieJar()
+        self.ready = False
+        self.refreshing = False
+        self.generation = 0
+        self.warmed_at = 0.0
+
+
+class SessionPoolMiddleware:
+    """Spread requests over a pool of warm server sessions
+
+    Each of SESSION_POOL_SIZE sessions has its own cookie jar, filled by a
+    GET of the home page (SESSION_WARMUP_URL, else the spider's start
+    URL). Requests are assigned to ready sessions round-robin and carry
+    ``meta['session_id']``. A 200 response that is nearly empty or contains
+    one of SESSION_INVALID_MARKERS means the server dropped the session:
+    it is re-warmed in the background while the request is retried on
+    another session (up to SESSION_MAX_RETRIES times), bypassing the HTTP
+    cache. PHHCCachePolicy never stores such pages. Sessions older than
+    SESSION_MAX_AGE seconds are refreshed while they stay in use.
+
+    This replaces CookiesMiddleware, which keeps a single jar per spider, so
+    COOKIES_ENABLED stays off. Counters are kept under ``session/``.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.size = max(settings.getint('SESSION_POOL_SIZE', 4), 1)
+        self.warmup_url = settings.get('SESSION_WARMUP_URL')
+        self.markers = [marker.lower().encode('utf-8') for marker in settings.getlist('SESSION_INVALID_MARKERS', [])]
+        self.min_body_bytes = settings.getint('SESSION_MIN_BODY_BYTES', 0)
+        self.max_age = settings.getfloat('SESSION_MAX_AGE', 0.0)
+        self.max_retries = settings.getint('SESSION_MAX_RETRIES', 2)
+        self.retry_delay = settings.getfloat('SESSION_WARMUP_RETRY_DELAY', 5.0)
+        self.max_warmup_failures = settings.getint('SESSION_WARMUP_MAX_FAILURES', 5)
+        self.slot_per_session = settings.getbool('SESSION_DOWNLOAD_SLOTS')
+        self.sessions = []
+        self.turn = 0
+        self.waiters = []
+        self.warmup_failures = 0
+        self.disabled = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SESSION_POOL_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def _start(self, spider):
+        self.sessions = [_Session(session_id) for session_id in range(self.size)]
+        for session in self.sessions:
+            self._refresh(session, spider)
+        spider.logger.info(f"Session pool: warming {self.size} sessions")
+
+    def _refresh(self, session, spider):
+        if session.refreshing:
+            return
+        session.refreshing = True
+        url = self.warmup_url or getattr(spider, 'start_url', None) or spider.start_urls[0]
+        request = Request(url, dont_filter=True, priority=1000,
+                          meta={'session_warmup': session.id, 'dont_cache': True})
+        d = self.crawler.engine.download(request)
+        d.addCallbacks(self._warmed, self._warmup_failed,
+                       callbackArgs=(session, request), errbackArgs=(session, spider))
+
+    def _warmed(self, response, session, request):
+        jar = CookieJar()
+        jar.extract_cookies(response, response.request or request)
+        session.jar = jar
+        session.ready = True
+        session.refreshing = False
+        session.generation += 1
+        session.warmed_at = time.time()
+        self.warmup_failures = 0
+        self.stats.inc_value('session/warmed')
+        self._wake()
+
+    def _warmup_failed(self, failure, session, spider):
+        from twisted.internet import reactor
+
+        session.refreshing = False
+        self.warmup_failures += 1
+        self.stats.inc_value('session/warmup_failed')
+        if self.warmup_failures >= self.max_warmup_failures and not any(s.ready for s in self.sessions):
+            if not self.disabled:
+                spider.logger.error(f"Session pool: {self.warmup_failures} warm-ups failed in a row "
+                                    f"({failure.getErrorMessage()}), sending requests without sessions")
+                self.disabled = True
+                self._wake()
+            return
+        spider.logger.warning(f"Session pool: warm-up of session {session.id} failed "
+                              f"({failure.getErrorMessage()}), retrying in {self.retry_delay:g} s")
+        reactor.callLater(self.retry_delay, self._refresh, session, spider)
+
+    def _wake(self):
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            waiter.callback(None)
+
+    async def _acquire(self, spider):
+        while not self.disabled:
+            ready = [session for session in self.sessions if session.ready]
+            if ready:
+                self.turn += 1
+                session = ready[self.turn % len(ready)]
+                if (self.max_age and not session.refreshing
+                        and time.time() - session.warmed_at > self.max_age):
+                    self.stats.inc_value('session/expired')
+                    self._refresh(session, spider)
+                return session
+            waiter = defer.Deferred()
+            self.waiters.append(waiter)
+            await maybe_deferred_to_future(waiter)
+        return None
+
+    async def process_request(self, request, spider):
+        if 'session_warmup' in request.meta or self.disabled:
+            return None
+        if not self.sessions:
+            self._start(spider)
+        session = await self._acquire(spider)
+        if session is None:
+            return None
+
+        # Retries and redirects copy the previous session's Cookie header
+        request.headers.pop('Cookie', None)
+        session.jar.add_cookie_header(request)
+        request.meta['session_id'] = session.id
+        request.meta['session_generation'] = session.generation
+        if self.slot_per_session:
+            request.meta['download_slot'] = f"{urlparse_cached(request).hostname}#session{session.id}"
+        return None
+
+    def _is_invalid(self, response):
+        if response.status != 200:
+            return False
+        body = response.body.lower()
+        if len(body) < self.min_body_bytes:
+            return True
+        return any(marker in body for marker in self.markers)
+
+    def process_response(self, request, response, spider):
+        session_id = request.meta.get('session_id')
+        if session_id is None or 'session_warmup' in request.meta:
+            return response
+        if 'replayed' in response.flags:
+            return response
+
+        session = self.sessions[session_id]
+        cached = 'cached' in response.flags
+        if not self._is_invalid(response):
+            if not cached:
+                session.jar.extract_cookies(response, request)
+            return response
+
+        self.stats.inc_value('session/invalid')
+        # Requests still in flight on the same session come back invalid too:
+        # only the first of them triggers a refresh. An invalid page from an
+        # older cache says nothing about the session, it is only refetched.
+        if not cached and session.ready and session.generation == request.meta.get('session_generation'):
+            session.ready = False
+            self._refresh(session, spider)
+            spider.logger.info(f"Session pool: session {session_id} invalid, refreshing")
+
+        retries = request.meta.get('session_retries', 0)
+        if retries >= self.max_retries:
+            self.stats.inc_value('session/gave_up')
+            return response
+        retry = request.replace(dont_filter=True)
+        retry.meta['session_retries'] = retries + 1
+        # Fetch the retry from the site, never from the HTTP cache
+        retry.meta['dont_cache'] = True
+        for key in ('session_id', 'session_generation'):
+            retry.meta.pop(key, None)
+        if self.slot_per_session:
+            retry.meta.pop('download_slot', None)
+        self.stats.inc_value('session/retries')
+        return retry
@@ -0,0 +1,110 @@
+# Content-addressed storage for downloaded order/judgment documents
+#
+# Bodies downloaded by OrderDownloadPipeline (through the Scrapy engine, so
+# the replay archive, HTTP cache, retries and throttling apply) are written
+# chunk by chunk to a temporary file while a running sha256 is updated
+# (DocumentWriter), then moved to <root>/<sha256[:2]>/<sha256><ext>, so a
+# document served under several URLs is kept once. A SQLite index maps
+# every fetched URL to its digest so later runs can skip URLs that are
+# already stored.
+
+import hashlib
+import mimetypes
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+class DocumentWriter:
+    """Temporary file and running sha256 of one document being received"""
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class OrderDocumentStore:
+    """Content-addressed document store with a URL -> digest index"""
+
+    def __init__(self, root, commit_every=100):
+        self.root = root
+        self.commit_every = commit_every
+        self.pending = 0
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite3'))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, path TEXT NOT NULL, "
+            "size INTEGER NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def lookup(self, url):
+        """Return the stored entry for a URL, or None"""
+        row = self.conn.execute(
+            "SELECT sha256, path, size FROM documents WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.root, row[1])):
+            return None
+        return {'url': url, 'sha256': row[0], 'path': row[1], 'size': row[2]}
+
+    def open_writer(self):
+        """DocumentWriter for a document about to be received"""
+        return DocumentWriter(os.path.join(self.root, 'tmp'))
+
+    def finish(self, writer, url, content_type=None):
+        """Move a completely written document into place (blocking; run it off the reactor thread)"""
+        try:
+            writer.file.close()
+            sha256 = writer.sha256.hexdigest()
+            extension = (mimetypes.guess_extension(content_type) if content_type else None) or ''
+            path = os.path.join(sha256[:2], sha256 + extension)
+            final_path = os.path.join(self.root, path)
+            if os.path.exists(final_path):
+                os.remove(writer.path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                shutil.move(writer.path, final_path)
+        except BaseException:
+            writer.abort()
+            raise
+        return {'url': url, 'sha256': sha256, 'path': path, 'size': writer.size}
+
+    def save(self, url, body, content_type=None):
+        """Store a body that is already in memory, e.g. from the HTTP cache (blocking)"""
+        writer = self.open_writer()
+        try:
+            writer.write(body)
+        except BaseException:
+            writer.abort()
+            raise
+        return self.finish(writer, url, content_type)
+
+    def add(self, entry):
+        """Index a fetched document (call from the thread that owns the connection)"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+            (entry['url'], entry['sha256'], entry['path'], entry['size'], time.time()),
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,78 @@
+# Loop-free pagination of search results
+#
+# Follow-up requests always carry the page they ask for: a real "Next" href
+# is followed as-is, otherwise the search form is re-submitted with the page
+# number added. Follow-ups are left to the dupefilter (POST bodies are part
+# of the fingerprint, see fingerprint.py), and every query stops after
+# PAGINATION_MAX_PAGES pages or as soon as a page repeats the previous one.
+
+import hashlib
+
+import scrapy
+
+
+def page_signature(rows):
+    """Digest of a result page's rows, used to detect a server ignoring the page number"""
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Paginator:
+    """Builds the follow-up request for the next page of a search"""
+
+    SIGNATURE_META_KEY = 'pagination_signature'
+
+    def __init__(self, logger, page_param='page', max_pages=200):
+        self.logger = logger
+        self.page_param = page_param
+        self.max_pages = max_pages
+        self.stats = {
+            'pages_followed': 0,
+            'repeated_pages': 0,
+            'max_pages_reached': 0,
+        }
+
+    @classmethod
+    def from_settings(cls, settings, logger):
+        return cls(
+            logger,
+            page_param=settings.get('PAGINATION_PAGE_PARAM', 'page'),
+            max_pages=settings.getint('PAGINATION_MAX_PAGES', 200),
+        )
+
+    def next_request(self, response, href, formdata, page, rows, callback, cb_kwargs):
+        """Request for page ``page + 1``, or None when pagination must stop
+
+        ``href`` is the "Next" link (None when there is none) and
+        ``formdata`` the search that produced ``response``.
+        """
+        if not href:
+            return None
+
+        signature = page_signature(rows)
+        if signature == response.meta.get(self.SIGNATURE_META_KEY):
+            self.stats['repeated_pages'] += 1
+            self.logger.warning(f"Page {page} repeats page {page - 1}, stopping pagination at {response.url}")
+            return None
+        if page >= self.max_pages:
+            self.stats['max_pages_reached'] += 1
+            self.logger.warning(f"Reached PAGINATION_MAX_PAGES={self.max_pages} at {response.url}")
+            return None
+
+        self.stats['pages_followed'] += 1
+        cb_kwargs = dict(cb_kwargs, page=page + 1)
+        meta = {self.SIGNATURE_META_KEY: signature}
+        if not href.startswith(('#', 'javascript:')):
+            return response.follow(href, callback=callback, cb_kwargs=cb_kwargs, meta=meta)
+
+        # Script-driven "Next": re-submit the search asking for the next page
+        formdata = dict(formdata, **{self.page_param: str(page + 1)})
+        return scrapy.FormRequest(
+            url=response.url,
+            formdata=formdata,
+            callback=callback,
+            cb_kwargs=cb_kwargs,
+            meta=meta,
+        )
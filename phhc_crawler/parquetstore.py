@@ -0,0 +1,189 @@
+# Partitioned Parquet dataset of crawl results
+#
+# Items are flattened into a stable schema: fixed fields plus one string
+# column per result-table header (col_<header>). Rows are buffered per
+# (case_type, month) partition and written as Parquet row groups under
+# hive-style directories (case_type=CRM-M/month=2024-05/part-*.parquet).
+# Every run writes new part files, so runs append to the same dataset. A
+# header seen for the first time adds a column to _schema.json; part files
+# written before that simply lack it and read back as nulls (read_dataset).
+
+import datetime
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+SCHEMA_FILE = '_schema.json'
+PARTITION_FIELDS = ('case_type', 'month')
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d')
+
+FIXED_FIELDS = [
+    pa.field('date', pa.string()),
+    pa.field('decision_date', pa.date32()),
+    pa.field('links', pa.list_(pa.string())),
+    pa.field('order_files', pa.string()),  # JSON list of {url, path, sha256, size}
+]
+
+
+def parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def column_name(header):
+    """Stable column name for a result-table header: 'Case No.' -> 'col_case_no'"""
+    name = re.sub(r'\W+', '_', header.strip().lower()).strip('_')
+    return f"col_{name or 'blank'}"
+
+
+def dataset_schema(columns):
+    """Arrow schema of the part files for the given {header: column} mapping"""
+    return pa.schema(FIXED_FIELDS + [pa.field(name, pa.string()) for name in columns.values()])
+
+
+def read_dataset(root):
+    """pyarrow Dataset over all part files, with columns added later filled with nulls"""
+    with open(os.path.join(root, SCHEMA_FILE), encoding='utf-8') as f:
+        columns = json.load(f)['columns']
+    schema = dataset_schema(columns)
+    for name in PARTITION_FIELDS:
+        schema = schema.append(pa.field(name, pa.string()))
+    partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_FIELDS]), flavor='hive')
+    return ds.dataset(root, format='parquet', partitioning=partitioning, schema=schema)
+
+
+class PartitionedParquetWriter:
+    """Streams flattened items into a hive-partitioned, append-only Parquet dataset"""
+
+    def __init__(self, root, row_group_size=5000, max_open_files=64, compression='zstd'):
+        self.root = root
+        self.row_group_size = row_group_size
+        self.max_open_files = max_open_files
+        self.compression = compression
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.sequence = 0
+        # {header: column name}, in the order headers were first seen
+        self.columns = {}
+        self.known_schemas = set()
+        self.schema_version = 0
+        self.buffers = {}
+        # {partition: (ParquetWriter, in-progress path, final path, schema version)}, LRU order
+        self.writers = OrderedDict()
+        self.stats = {
+            'rows_written': 0,
+            'row_groups_written': 0,
+            'files_written': 0,
+            'columns_added': 0,
+        }
+        os.makedirs(root, exist_ok=True)
+        self._load_schema()
+
+    def _load_schema(self):
+        path = os.path.join(self.root, SCHEMA_FILE)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.columns = json.load(f)['columns']
+        self.schema = dataset_schema(self.columns)
+
+    def _save_schema(self):
+        path = os.path.join(self.root, SCHEMA_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'columns': self.columns}, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _add_columns(self, headers):
+        taken = set(self.columns.values())
+        for header in headers:
+            if header in self.columns:
+                continue
+            name = base = column_name(header)
+            suffix = 2
+            while name in taken:
+                name = f"{base}_{suffix}"
+                suffix += 1
+            self.columns[header] = name
+            taken.add(name)
+            self.stats['columns_added'] += 1
+        self.schema = dataset_schema(self.columns)
+        self.schema_version += 1
+        self._save_schema()
+
+    def add(self, case_type, date, columns, links, order_files=None):
+        # Rows of a page share one RowSchema: check its headers only once
+        schema = getattr(columns, 'schema', None)
+        if schema is None or schema not in self.known_schemas:
+            if any(header not in self.columns for header in columns):
+                self._add_columns(columns)
+            if schema is not None:
+                self.known_schemas.add(schema)
+
+        decision_date = parse_date(date)
+        partition = (case_type or 'unknown', decision_date.strftime('%Y-%m') if decision_date else 'unknown')
+        row = {
+            'date': date,
+            'decision_date': decision_date,
+            'links': list(links or ()),
+            'order_files': json.dumps(order_files) if order_files else None,
+        }
+        for header, value in columns.items():
+            row[self.columns[header]] = value
+
+        buffer = self.buffers.setdefault(partition, [])
+        buffer.append(row)
+        if len(buffer) >= self.row_group_size:
+            self._flush(partition)
+
+    def _writer(self, partition):
+        entry = self.writers.get(partition)
+        if entry is not None and entry[3] != self.schema_version:
+            # New columns since this part file was opened: start a new one
+            self._close_writer(partition)
+            entry = None
+        if entry is None:
+            if len(self.writers) >= self.max_open_files:
+                self._close_writer(next(iter(self.writers)))
+            directory = os.path.join(self.root, *(f"{name}={quote(value, safe='')}"
+                                                  for name, value in zip(PARTITION_FIELDS, partition)))
+            os.makedirs(directory, exist_ok=True)
+            self.sequence += 1
+            filename = f"part-{self.run_id}-{self.sequence:05d}.parquet"
+            # Dot-prefixed while open: dataset discovery skips unfinished files
+            in_progress = os.path.join(directory, f".{filename}.inprogress")
+            writer = pq.ParquetWriter(in_progress, self.schema, compression=self.compression)
+            entry = (writer, in_progress, os.path.join(directory, filename), self.schema_version)
+        self.writers[partition] = entry
+        self.writers.move_to_end(partition)
+        return entry[0]
+
+    def _close_writer(self, partition):
+        writer, in_progress, final_path, _ = self.writers.pop(partition)
+        writer.close()
+        os.replace(in_progress, final_path)
+        self.stats['files_written'] += 1
+
+    def _flush(self, partition):
+        rows = self.buffers.pop(partition, None)
+        if not rows:
+            return
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        self._writer(partition).write_table(table, row_group_size=len(rows))
+        self.stats['rows_written'] += len(rows)
+        self.stats['row_groups_written'] += 1
+
+    def close(self):
+        for partition in list(self.buffers):
+            self._flush(partition)
+        for partition in list(self.writers):
+            self._close_writer(partition)
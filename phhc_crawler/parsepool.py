@@ -0,0 +1,75 @@
+# Result-page parsing in a process pool (PARSE_POOL_WORKERS)
+#
+# Parsing a large results page on the reactor thread stalls every download
+# until it is done. With a pool, the response body is handed to a worker
+# process that runs the same page parser (extractors.parse_*_page) and sends
+# back plain rows; the spider builds items and follow-up requests from them
+# once the returned Deferred fires, so downloads and parsing overlap.
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from urllib.parse import urljoin
+
+from parsel import Selector
+from scrapy.utils.response import get_base_url
+from twisted.internet import defer
+
+
+def _parse_in_worker(parser, body, encoding, base_url):
+    start = time.process_time()
+    selector = Selector(text=body.decode(encoding, 'replace'), base_url=base_url)
+    result = parser(selector, partial(urljoin, base_url))
+    return result, time.process_time() - start
+
+
+class ParsePool:
+    """Runs page parsers in worker processes and returns Deferreds"""
+
+    def __init__(self, workers):
+        # Workers are spawned, not forked, so they never inherit the reactor
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        self.workers = workers
+        self.stats = {
+            'pages_parsed': 0,
+            'worker_cpu_seconds': 0.0,
+            'parse_errors': 0,
+        }
+
+    @classmethod
+    def from_settings(cls, settings):
+        """A pool of PARSE_POOL_WORKERS processes, or None when parsing stays in-process"""
+        workers = settings.getint('PARSE_POOL_WORKERS', 0)
+        if workers <= 0:
+            return None
+        return cls(workers)
+
+    def parse(self, parser, response):
+        """Deferred firing with ``parser(selector, urljoin)`` run on the response in a worker"""
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+        future = self.executor.submit(_parse_in_worker, parser, response.body, response.encoding,
+                                      get_base_url(response))
+
+        def done(future):
+            # Runs in the executor's management thread
+            reactor.callFromThread(self._deliver, d, future)
+
+        future.add_done_callback(done)
+        return d
+
+    def _deliver(self, d, future):
+        try:
+            result, cpu_seconds = future.result()
+        except Exception as e:
+            self.stats['parse_errors'] += 1
+            d.errback(e)
+            return
+        self.stats['pages_parsed'] += 1
+        self.stats['worker_cpu_seconds'] += cpu_seconds
+        d.callback(result)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
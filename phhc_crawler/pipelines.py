@@ -7,10 +7,24 @@
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 import pandas as pd
+import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+import datetime
 import time
 import logging
 import os
-from scrapy.exceptions import DropItem
+import queue
+import threading
+from urllib.parse import urlsplit
+from scrapy import Request, signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.misc import load_object
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+from .batchclean import clean_batch
+from .dedup import MemoryDedupStore, item_digest
+from .orderstore import OrderDocumentStore
 
 class PhhcCrawlerPipeline:
     """Basic pipeline for item validation and cleaning"""
@@ -32,12 +46,18 @@ class PhhcCrawlerPipeline:
 class PerformancePipeline:
     """Pipeline for monitoring scraping performance in real-time"""
     
-    def __init__(self):
+    def __init__(self, stats=None):
         self.item_count = 0
         self.start_time = time.time()
         self.last_report_time = time.time()
         self.last_report_count = 0
         self.report_interval = 100  # Report every 100 items
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # The rates also go to the crawl stats, so metrics snapshots carry them
+        return cls(stats=crawler.stats)
         
     def process_item(self, item, spider):
         self.item_count += 1
@@ -59,6 +79,10 @@ class PerformancePipeline:
                 f"Elapsed Time: {elapsed_time/60:.1f} minutes"
             )
             
+            if self.stats is not None:
+                self.stats.set_value('performance/items_per_sec', round(overall_rate, 2))
+                self.stats.set_value('performance/current_items_per_sec', round(interval_rate, 2))
+
             self.last_report_time = current_time
             self.last_report_count = self.item_count
             
@@ -74,165 +98,638 @@ class PerformancePipeline:
             f"Average Rate: {final_rate:.1f} items/sec"
         )
 
-class OptimizedExcelExportPipeline:
-    """Optimized pipeline for Excel export with memory management and error handling"""
+_STOP = object()
+
+
+class BackgroundWriterPipeline:
+    """Base for export pipelines whose file I/O runs on a dedicated writer thread
+
+    process_item() only turns the item into a plain row (serialize(), on the
+    reactor thread) and puts it on a bounded queue. The writer thread takes
+    rows off in batches of up to EXPORT_WRITER_BATCH_SIZE, waiting at most
+    EXPORT_WRITER_FLUSH_INTERVAL seconds for a batch to fill, and hands them
+    to write_batch(). When EXPORT_WRITER_QUEUE_SIZE rows are waiting,
+    process_item() returns a Deferred that fires once the writer has made
+    room, which holds back the scraper instead of growing the queue.
+    close_spider() drains the queue and runs close_writer() on the thread.
+    """
+
+    def __init__(self, queue_size=10000, batch_size=500, flush_interval=1.0):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = None
+        self.thread = None
+        self.reactor = None
+        # (row, item, Deferred) held back while the queue is full
+        self.blocked = []
+        self.writer_stats = {
+            'rows': 0,
+            'batches': 0,
+            'write_seconds': 0.0,
+            'backpressure_waits': 0,
+            'errors': 0,
+        }
+
+    @staticmethod
+    def writer_options(settings):
+        return {
+            'queue_size': settings.getint('EXPORT_WRITER_QUEUE_SIZE', 10000),
+            'batch_size': settings.getint('EXPORT_WRITER_BATCH_SIZE', 500),
+            'flush_interval': settings.getfloat('EXPORT_WRITER_FLUSH_INTERVAL', 1.0),
+        }
+
+    def open_writer(self, spider):
+        """Called on the reactor thread before the writer thread starts"""
+
+    def serialize(self, adapter, spider):
+        """Plain, immutable row for write_batch(); runs on the reactor thread"""
+        raise NotImplementedError
+
+    def write_batch(self, rows, spider):
+        """Write a batch of rows; runs on the writer thread"""
+        raise NotImplementedError
+
+    def close_writer(self, spider):
+        """Flush and close the output; runs on the writer thread"""
+
+    def open_spider(self, spider):
+        from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.queue = queue.Queue(self.queue_size)
+        self.open_writer(spider)
+        self.thread = threading.Thread(target=self._run, args=(spider,),
+                                       name=f"{type(self).__name__}-writer", daemon=True)
+        self.thread.start()
+
+    def process_item(self, item, spider):
+        row = self.serialize(ItemAdapter(item), spider)
+        if row is None:
+            return item
+        if not self.blocked:
+            try:
+                self.queue.put_nowait(row)
+                return item
+            except queue.Full:
+                pass
+        self.writer_stats['backpressure_waits'] += 1
+        d = defer.Deferred()
+        self.blocked.append((row, item, d))
+        return d
+
+    def _unblock(self):
+        # Reactor thread: move held-back rows into the queue while it has room
+        while self.blocked:
+            row, item, d = self.blocked[0]
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                return
+            self.blocked.pop(0)
+            d.callback(item)
+
+    def _next_batch(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+                break
+            except queue.Empty:
+                # Rows held back after the queue was last seen full
+                if self.blocked:
+                    self.reactor.callFromThread(self._unblock)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, spider):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                start = time.perf_counter()
+                try:
+                    self.write_batch(batch, spider)
+                except Exception as e:
+                    self.writer_stats['errors'] += 1
+                    spider.logger.error(f"{type(self).__name__}: error writing {len(batch)} rows: {e}")
+                self.writer_stats['write_seconds'] += time.perf_counter() - start
+                self.writer_stats['rows'] += len(batch)
+                self.writer_stats['batches'] += 1
+            if self.blocked:
+                self.reactor.callFromThread(self._unblock)
+            if stop:
+                break
+        try:
+            self.close_writer(spider)
+        except Exception as e:
+            self.writer_stats['errors'] += 1
+            spider.logger.error(f"{type(self).__name__}: error closing the output: {e}")
+
+    def _finish(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def close_spider(self, spider):
+        if self.thread is None:
+            return None
+        from twisted.internet import threads
+
+        d = threads.deferToThread(self._finish)
+        d.addCallback(lambda _: spider.logger.info(
+            f"{type(self).__name__} writer stats: {dict(self.writer_stats, write_seconds=round(self.writer_stats['write_seconds'], 3))}"
+        ))
+        return d
+
+
+class OptimizedExcelExportPipeline(BackgroundWriterPipeline):
+    """Streaming Excel export - rows are appended to a write-only workbook on a writer thread"""
     
-    def __init__(self):
-        self.items = []
-        self.batch_size = 1000  # Process items in batches to manage memory
-        self.batch_count = 0
-        self.temp_files = []
+    def __init__(self, **writer_options):
+        super().__init__(**writer_options)
+        self.workbook = None
+        self.sheet = None
+        self.filename = None
+        self.fields = None
+        self.row_count = 0
+        self.case_types = set()
+        self.min_date = None
+        self.max_date = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(**cls.writer_options(crawler.settings))
         
-    def process_item(self, item, spider):
-        self.items.append(dict(item))
+    def open_writer(self, spider):
+        # Write-only worksheets spool rows to a temp file, so memory stays flat
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('Case_Data')
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        self.filename = f"phhc_results_{timestamp}.xlsx"
         
-        # Process in batches to avoid memory issues
-        if len(self.items) >= self.batch_size:
-            self._save_batch(spider)
-            
-        return item
+    def serialize(self, adapter, spider):
+        rows = []
+        if self.fields is None:
+            self.fields = list(adapter.field_names())
+            rows.append(self.fields)
+        rows.append([self._cell_value(adapter.get(field)) for field in self.fields])
+        self._update_summary(adapter)
+        return rows
+
+    def write_batch(self, rows, spider):
+        for item_rows in rows:
+            for row in item_rows:
+                try:
+                    self.sheet.append(row)
+                except Exception as e:
+                    spider.logger.error(f"Error writing row {row[:2]}: {e}")
     
-    def _save_batch(self, spider):
-        """Save a batch of items to a temporary file"""
-        if not self.items:
+    @staticmethod
+    def _cell_value(value):
+        """Flatten nested values the way pandas would render them in a cell"""
+        if value is None:
+            return None
+        if not isinstance(value, (str, int, float)):
+            value = str(value)
+        if isinstance(value, str):
+            value = ILLEGAL_CHARACTERS_RE.sub('', value)
+        return value
+    
+    def _update_summary(self, adapter):
+        """Keep running aggregates for the Summary sheet"""
+        self.row_count += 1
+        case_type = adapter.get('case_type')
+        if case_type:
+            self.case_types.add(case_type)
+        
+        date_value = adapter.get('date')
+        if not date_value:
             return
-            
         try:
-            df = pd.DataFrame(self.items)
-            temp_filename = f"temp_batch_{self.batch_count}.xlsx"
-            df.to_excel(temp_filename, index=False)
-            self.temp_files.append(temp_filename)
-            self.batch_count += 1
-            
-            spider.logger.info(f"Saved batch {self.batch_count} with {len(self.items)} items")
-            
-            # Clear items to free memory
-            self.items = []
-            
-        except Exception as e:
-            spider.logger.error(f"Error saving batch {self.batch_count}: {e}")
+            sort_key = datetime.datetime.strptime(date_value, '%d/%m/%Y')
+        except (TypeError, ValueError):
+            return
+        if self.min_date is None or sort_key < self.min_date[0]:
+            self.min_date = (sort_key, date_value)
+        if self.max_date is None or sort_key > self.max_date[0]:
+            self.max_date = (sort_key, date_value)
     
-    def close_spider(self, spider):
-        """Combine all batches into final Excel file and clean up"""
+    def close_writer(self, spider):
+        """Add the Summary sheet and save the workbook"""
+        if not self.row_count:
+            spider.logger.warning("No data to export")
+            return
+        
         try:
-            # Save any remaining items
-            if self.items:
-                self._save_batch(spider)
+            date_range = 'N/A'
+            if self.min_date and self.max_date:
+                date_range = f"{self.min_date[1]} to {self.max_date[1]}"
             
-            if not self.temp_files:
-                spider.logger.warning("No data to export")
-                return
+            summary = self.workbook.create_sheet('Summary')
+            summary.append(['Metric', 'Value'])
+            summary.append(['Total Cases', self.row_count])
+            summary.append(['Unique Case Types', len(self.case_types)])
+            summary.append(['Date Range', date_range])
+            summary.append(['Export Time', time.strftime("%Y-%m-%d %H:%M:%S")])
             
-            # Combine all temporary files
-            all_dataframes = []
-            for temp_file in self.temp_files:
-                try:
-                    df = pd.read_excel(temp_file)
-                    all_dataframes.append(df)
-                except Exception as e:
-                    spider.logger.error(f"Error reading {temp_file}: {e}")
+            self.workbook.save(self.filename)
+            spider.logger.info(f"Successfully exported {self.row_count} items to {self.filename}")
             
-            if all_dataframes:
-                # Combine all dataframes
-                final_df = pd.concat(all_dataframes, ignore_index=True)
-                
-                # Export to final Excel file with timestamp
-                timestamp = time.strftime("%Y%m%d_%H%M%S")
-                final_filename = f"phhc_results_{timestamp}.xlsx"
-                
-                # Add some formatting and metadata
-                with pd.ExcelWriter(final_filename, engine='openpyxl') as writer:
-                    final_df.to_excel(writer, sheet_name='Case_Data', index=False)
-                    
-                    # Add summary sheet
-                    summary_data = {
-                        'Metric': ['Total Cases', 'Unique Case Types', 'Date Range', 'Export Time'],
-                        'Value': [
-                            len(final_df),
-                            final_df['case_type'].nunique() if 'case_type' in final_df.columns else 'N/A',
-                            f"{final_df['date'].min()} to {final_df['date'].max()}" if 'date' in final_df.columns else 'N/A',
-                            time.strftime("%Y-%m-%d %H:%M:%S")
-                        ]
-                    }
-                    summary_df = pd.DataFrame(summary_data)
-                    summary_df.to_excel(writer, sheet_name='Summary', index=False)
-                
-                spider.logger.info(f"Successfully exported {len(final_df)} items to {final_filename}")
-                
-                # Clean up temporary files
-                for temp_file in self.temp_files:
-                    try:
-                        os.remove(temp_file)
-                    except Exception as e:
-                        spider.logger.warning(f"Could not remove {temp_file}: {e}")
-                        
-            else:
-                spider.logger.error("No valid data found in temporary files")
-                
         except Exception as e:
             spider.logger.error(f"Error in close_spider: {e}")
-            # Fallback: try to save whatever data we have
-            if self.items:
-                try:
-                    df = pd.DataFrame(self.items)
-                    df.to_excel("fallback_results.xlsx", index=False)
-                    spider.logger.info(f"Saved {len(self.items)} items to fallback_results.xlsx")
-                except Exception as fallback_error:
-                    spider.logger.error(f"Fallback save also failed: {fallback_error}")
 
 class DataValidationPipeline:
-    """Pipeline for data quality validation and filtering"""
+    """Pipeline for data quality validation and filtering
+
+    With VALIDATION_BATCH_SIZE > 0, items are held for up to that many items
+    or VALIDATION_BATCH_INTERVAL seconds and cleaned and checked together as
+    columns (see batchclean.py): string fields are stripped, the date and
+    Decision Date columns are parsed and rows with neither counted as
+    undated. Each held item gets a Deferred that fires with the item, or
+    with its own DropItem.
+    """
     
-    def __init__(self):
+    def __init__(self, dedup_store=None, batch_size=0, batch_interval=0.05):
         self.stats = {
             'total_items': 0,
             'valid_items': 0,
             'invalid_items': 0,
             'duplicate_items': 0
         }
-        self.seen_items = set()
+        self.seen_items = dedup_store if dedup_store is not None else MemoryDedupStore()
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        # (item, Deferred) waiting for the next batch
+        self.batch = []
+        self.timer = None
+        if batch_size:
+            self.stats['undated_items'] = 0
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        store_cls = load_object(settings.get('DEDUP_BACKEND', 'phhc_crawler.dedup.MemoryDedupStore'))
+        return cls(
+            dedup_store=store_cls.from_settings(settings),
+            batch_size=settings.getint('VALIDATION_BATCH_SIZE', 0),
+            batch_interval=settings.getfloat('VALIDATION_BATCH_INTERVAL', 0.05),
+        )
     
     def process_item(self, item, spider):
+        if self.batch_size:
+            return self._enqueue(item, spider)
+
         self.stats['total_items'] += 1
         adapter = ItemAdapter(item)
-        
-        # Create a simple fingerprint for duplicate detection
-        fingerprint = f"{adapter.get('case_number', '')}-{adapter.get('date', '')}-{adapter.get('case_type', '')}"
-        
-        if fingerprint in self.seen_items:
-            self.stats['duplicate_items'] += 1
-            spider.logger.debug(f"Duplicate item found: {fingerprint}")
-            raise DropItem(f"Duplicate item: {fingerprint}")
-        
-        self.seen_items.add(fingerprint)
+        self._check_duplicate(adapter, spider)
         
         # Validate required fields
-        required_fields = ['case_number', 'date', 'case_type']
+        required_fields = ['date', 'case_type', 'links']
         missing_fields = [field for field in required_fields if not adapter.get(field)]
+        self._check_missing(item, missing_fields, spider)
         
+        self.stats['valid_items'] += 1
+        return item
+
+    def _check_duplicate(self, adapter, spider):
+        # Fingerprint the row identity (order links, or column values) as a 64-bit digest
+        fingerprint = item_digest(adapter)
+        
+        if not self.seen_items.add(fingerprint):
+            self.stats['duplicate_items'] += 1
+            fingerprint_hex = f"{fingerprint & 0xFFFFFFFFFFFFFFFF:016x}"
+            spider.logger.debug(f"Duplicate item found: {fingerprint_hex}")
+            raise DropItem(f"Duplicate item: {fingerprint_hex}")
+
+    def _check_missing(self, item, missing_fields, spider):
         if missing_fields:
             self.stats['invalid_items'] += 1
             spider.logger.warning(f"Item missing required fields {missing_fields}: {item}")
             raise DropItem(f"Missing required fields: {missing_fields}")
+
+    def _enqueue(self, item, spider):
+        d = defer.Deferred()
+        self.batch.append((item, d))
+        if len(self.batch) >= self.batch_size:
+            self._flush(spider)
+        elif self.timer is None:
+            from twisted.internet import reactor
+            
+            self.timer = reactor.callLater(self.batch_interval, self._flush, spider)
+        return d
+
+    def _flush(self, spider):
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+        entries, self.batch = self.batch, []
+        if not entries:
+            return
+
+        columns, missing, undated = clean_batch([item for item, _ in entries])
+        self.stats['undated_items'] += int(undated.sum())
+        # Row identities for the dedup check, from the cleaned columns
+        size = len(entries)
+        identities = [
+            {'case_type': case_type, 'links': links, 'columns': row_columns}
+            for case_type, links, row_columns in zip(
+                columns.get('case_type', [None] * size),
+                columns.get('links', [None] * size),
+                columns.get('columns', [None] * size),
+            )
+        ]
+        # Duplicates are checked in arrival order, as in per-item mode
+        for (item, d), identity, missing_fields in zip(entries, identities, missing):
+            self.stats['total_items'] += 1
+            try:
+                self._check_duplicate(identity, spider)
+                self._check_missing(item, list(missing_fields), spider)
+            except DropItem as e:
+                d.errback(e)
+                continue
+            self.stats['valid_items'] += 1
+            d.callback(item)
+    
+    def close_spider(self, spider):
+        self._flush(spider)
+        self.seen_items.close()
+        spider.logger.info(f"Data Validation Stats: {self.stats}, dedup entries: {len(self.seen_items)}")
+
+class OrderDownloadPipeline:
+    """Downloads "View Order" documents into a content-addressed store
+
+    Documents are requested through the Scrapy engine, so the downloader
+    middlewares (replay archive, HTTP cache, retries, session pool, AIMD)
+    and download slots apply to them as to search pages. As the body
+    arrives, bytes_received appends each chunk to a temporary file and a
+    running sha256 (a retry starts a new file from headers_received), so
+    the finished download only has to be moved into place, on a thread
+    pool. Responses that never reach the network (HTTP cache, replay
+    archive) are written from their body instead.
+    """
+    
+    def __init__(self, crawler, store, concurrency=8, per_host=4, maxsize=0):
+        self.crawler = crawler
+        self.store = store
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.maxsize = maxsize
+        self.threadpool = None
+        self.host_semaphores = {}
+        self.inflight = {}
+        # {url: DocumentWriter} of documents being received
+        self.writers = {}
+        self.stats = {
+            'downloaded': 0,
+            'already_stored': 0,
+            'failed': 0,
+            'bytes': 0
+        }
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ORDER_DOWNLOAD_ENABLED', True):
+            raise NotConfigured
+        pipeline = cls(
+            crawler,
+            OrderDocumentStore(settings.get('ORDER_STORE_DIR', 'orders')),
+            concurrency=settings.getint('ORDER_DOWNLOAD_CONCURRENCY', 8),
+            per_host=settings.getint('ORDER_DOWNLOAD_PER_HOST', 4),
+            maxsize=settings.getint('ORDER_DOWNLOAD_MAXSIZE', settings.getint('DOWNLOAD_MAXSIZE')),
+        )
+        crawler.signals.connect(pipeline.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(pipeline.bytes_received, signal=signals.bytes_received)
+        return pipeline
+    
+    def open_spider(self, spider):
+        self.threadpool = ThreadPool(maxthreads=self.concurrency, name='order-downloads')
+        self.threadpool.start()
+    
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        urls = adapter.get('links') or []
+        if not urls:
+            return item
         
-        self.stats['valid_items'] += 1
-        return item
+        downloads = [self._download(url, spider) for url in urls]
+        d = defer.gatherResults(downloads)
+        
+        def attach(entries):
+            adapter['order_files'] = entries
+            return item
+        
+        return d.addCallback(attach)
+    
+    def _download(self, url, spider):
+        entry = self.store.lookup(url)
+        if entry is not None:
+            self.stats['already_stored'] += 1
+            return defer.succeed(self._with_local_path(entry))
+        
+        # The same order can be linked from several rows in flight at once
+        if url in self.inflight:
+            waiter = defer.Deferred()
+            self.inflight[url].append(waiter)
+            return waiter
+        self.inflight[url] = []
+        
+        host = urlsplit(url).netloc
+        semaphore = self.host_semaphores.setdefault(host, defer.DeferredSemaphore(self.per_host))
+        d = semaphore.run(self._fetch, url)
+        d.addCallbacks(self._stored, self._failed, errbackArgs=(url, spider))
+        d.addBoth(self._release_waiters, url)
+        return d
+    
+    def _fetch(self, url):
+        request = Request(url, meta={'order_download': url, 'download_maxsize': self.maxsize})
+        d = self.crawler.engine.download(request)
+        d.addCallbacks(self._save, self._discard_writer, callbackArgs=(url,), errbackArgs=(url,))
+        return d
+    
+    def headers_received(self, headers, body_length, request, spider):
+        url = request.meta.get('order_download')
+        if url is None:
+            return
+        # Every attempt (retries included) starts a file of its own
+        self._discard_writer(None, url)
+        self.writers[url] = self.store.open_writer()
+    
+    def bytes_received(self, data, request, spider):
+        url = request.meta.get('order_download')
+        writer = self.writers.get(url) if url is not None else None
+        if writer is not None:
+            writer.write(data)
+    
+    def _discard_writer(self, failure, url):
+        writer = self.writers.pop(url, None)
+        if writer is not None:
+            writer.abort()
+        return failure
+    
+    def _save(self, response, url):
+        from twisted.internet import reactor
+        
+        writer = self.writers.pop(url, None)
+        if response.status != 200:
+            if writer is not None:
+                writer.abort()
+            raise IOError(f"HTTP {response.status}")
+        content_type = response.headers.get('Content-Type', b'').decode('latin-1').split(';')[0].strip()
+        # No streamed copy (cached or replayed response), or one that is not
+        # the final body (e.g. a compressed transfer decoded by the middlewares)
+        if writer is None or writer.size != len(response.body):
+            if writer is not None:
+                writer.abort()
+            return threads.deferToThreadPool(reactor, self.threadpool, self.store.save,
+                                             url, response.body, content_type or None)
+        return threads.deferToThreadPool(reactor, self.threadpool, self.store.finish,
+                                         writer, url, content_type or None)
+    
+    def _stored(self, entry):
+        self.store.add(entry)
+        self.stats['downloaded'] += 1
+        self.stats['bytes'] += entry['size']
+        return self._with_local_path(entry)
+    
+    def _failed(self, failure, url, spider):
+        self.stats['failed'] += 1
+        spider.logger.warning(f"Failed to download order {url}: {failure.getErrorMessage()}")
+        return {'url': url, 'error': failure.getErrorMessage()}
+    
+    def _release_waiters(self, entry, url):
+        for waiter in self.inflight.pop(url, []):
+            waiter.callback(dict(entry))
+        return entry
+    
+    def _with_local_path(self, entry):
+        return dict(entry, path=os.path.join(self.store.root, entry['path']))
     
     def close_spider(self, spider):
-        spider.logger.info(f"Data Validation Stats: {self.stats}")
+        for url in list(self.writers):
+            self._discard_writer(None, url)
+        if self.threadpool is not None:
+            self.threadpool.stop()
+        self.store.close()
+        spider.logger.info(f"Order Download Stats: {self.stats}")
+
+class SQLiteResultsPipeline(BackgroundWriterPipeline):
+    """Upserts rows into an indexed SQLite/FTS5 results database (see resultstore.py)
+
+    Each writer batch is one transaction, so ingest keeps up with the crawl.
+    """
+
+    def __init__(self, path, **writer_options):
+        super().__init__(**writer_options)
+        self.path = path
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RESULTS_DB_ENABLED'):
+            raise NotConfigured
+        return cls(settings.get('RESULTS_DB_PATH', 'results.sqlite3'), **cls.writer_options(settings))
+
+    def open_writer(self, spider):
+        from .resultstore import ResultStore
+
+        # Created here, used only by the writer thread from now on
+        self.store = ResultStore(self.path, check_same_thread=False)
+        if not self.store.fts:
+            spider.logger.warning("SQLite has no FTS5 support: text queries on %s will scan", self.path)
+
+    def serialize(self, adapter, spider):
+        return (
+            adapter.get('case_type'),
+            adapter.get('date'),
+            adapter.get('columns'),
+            adapter.get('links'),
+            adapter.get('order_files'),
+        )
+
+    def write_batch(self, rows, spider):
+        self.store.upsert_many([self.store.row(*row) for row in rows])
+
+    def close_writer(self, spider):
+        spider.logger.info(f"Results database {self.path}: {self.store.count()} rows")
+        self.store.close()
+
+class ParquetExportPipeline(BackgroundWriterPipeline):
+    """Streams items into a partitioned Parquet dataset (see parquetstore.py) on a writer thread"""
+
+    def __init__(self, root, row_group_size=5000, max_open_files=64, **writer_options):
+        super().__init__(**writer_options)
+        self.root = root
+        self.row_group_size = row_group_size
+        self.max_open_files = max_open_files
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PARQUET_EXPORT_ENABLED'):
+            raise NotConfigured
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise NotConfigured("pyarrow is not installed (pip install pyarrow)")
+        return cls(
+            settings.get('PARQUET_DATASET_DIR', 'results_parquet'),
+            row_group_size=settings.getint('PARQUET_ROW_GROUP_SIZE', 5000),
+            max_open_files=settings.getint('PARQUET_MAX_OPEN_FILES', 64),
+            **cls.writer_options(settings),
+        )
+
+    def open_writer(self, spider):
+        from .parquetstore import PartitionedParquetWriter
+
+        self.writer = PartitionedParquetWriter(
+            self.root,
+            row_group_size=self.row_group_size,
+            max_open_files=self.max_open_files,
+        )
+
+    def serialize(self, adapter, spider):
+        return (
+            adapter.get('case_type'),
+            adapter.get('date'),
+            adapter.get('columns') or {},
+            adapter.get('links'),
+            adapter.get('order_files'),
+        )
+
+    def write_batch(self, rows, spider):
+        for row in rows:
+            self.writer.add(*row)
+
+    def close_writer(self, spider):
+        self.writer.close()
+        spider.logger.info(f"Parquet dataset written to {self.root}: {self.writer.stats}")
 
 # Legacy pipeline kept for backward compatibility
-class ExcelExportPipeline:
+class ExcelExportPipeline(BackgroundWriterPipeline):
     """Legacy pipeline - kept for backward compatibility, but OptimizedExcelExportPipeline is recommended"""
     
-    def __init__(self):
+    def __init__(self, **writer_options):
+        super().__init__(**writer_options)
         self.items = []
 
-    def process_item(self, item, spider):
-        self.items.append(dict(item))
-        return item
+    def serialize(self, adapter, spider):
+        return adapter.asdict()
 
-    def close_spider(self, spider):
+    def write_batch(self, rows, spider):
+        self.items.extend(rows)
+
+    def close_writer(self, spider):
         if self.items:
             df = pd.DataFrame(self.items)
             df.to_excel("results.xlsx", index=False)
@@ -0,0 +1,209 @@
+# Adaptive date-window query planner for the PHHC search form
+#
+# Instead of one POST per case type per day, each case type walks the
+# lookback period with a date window whose width adapts to how dense the
+# results are: windows that trip "refine your query" (or the row cap) are
+# split in half, and case types that keep coming back sparse get wider
+# windows for the rest of the walk. Walks go newest-first by default, and
+# every window gets a scheduler priority from its recency and its case
+# type's yield (rows per day), so useful results arrive early.
+
+import datetime
+import math
+from collections import namedtuple
+
+
+DATE_FORMAT = '%d/%m/%Y'
+
+
+class DateWindow(namedtuple('DateWindow', ['start', 'end', 'root'])):
+    """Inclusive range of days queried as a single search.
+
+    ``root`` windows drive the walk over the lookback period; windows
+    produced by splitting only cover their parent's range.
+    """
+
+    __slots__ = ()
+
+    @property
+    def days(self):
+        return (self.end - self.start).days + 1
+
+    @property
+    def from_date(self):
+        return self.start.strftime(DATE_FORMAT)
+
+    @property
+    def to_date(self):
+        return self.end.strftime(DATE_FORMAT)
+
+    def split(self):
+        """Split into two non-overlapping halves (never roots)"""
+        half = self.days // 2
+        middle = self.start + datetime.timedelta(days=half - 1)
+        return (
+            DateWindow(self.start, middle, False),
+            DateWindow(middle + datetime.timedelta(days=1), self.end, False),
+        )
+
+    def __str__(self):
+        if self.start == self.end:
+            return self.from_date
+        return f"{self.from_date}-{self.to_date}"
+
+
+class QueryPlanner:
+    """Plans date windows per case type and adapts their width to result density"""
+
+    def __init__(self, start, end, initial_days=16, min_days=1, max_days=61,
+                 sparse_rows=20, row_cap=500, newest_first=True, yield_weight=4):
+        self.start = start
+        self.end = end
+        self.initial_days = initial_days
+        self.min_days = min_days
+        self.max_days = max_days
+        self.sparse_rows = sparse_rows
+        self.row_cap = row_cap
+        self.newest_first = newest_first
+        self.yield_weight = yield_weight
+        self.widths = {}
+        self.skip_days = {}
+        # {case_type: [rows, days]} from past runs and completed windows
+        self.yields = {}
+        self.stats = {
+            'windows_planned': 0,
+            'windows_split': 0,
+            'windows_widened': 0,
+            'windows_narrowed': 0,
+            'unsplittable_windows': 0,
+            'days_skipped': 0,
+        }
+
+    @classmethod
+    def from_settings(cls, settings, today=None):
+        today = today or datetime.date.today()
+        lookback = settings.getint('PLANNER_LOOKBACK_DAYS', 61)
+        return cls(
+            start=today - datetime.timedelta(days=lookback),
+            end=today - datetime.timedelta(days=1),
+            initial_days=settings.getint('PLANNER_INITIAL_WINDOW_DAYS', 16),
+            min_days=settings.getint('PLANNER_MIN_WINDOW_DAYS', 1),
+            max_days=settings.getint('PLANNER_MAX_WINDOW_DAYS', lookback),
+            sparse_rows=settings.getint('PLANNER_SPARSE_ROWS', 20),
+            row_cap=settings.getint('PLANNER_ROW_CAP', 500),
+            newest_first=settings.getbool('PLANNER_NEWEST_FIRST', True),
+            yield_weight=settings.getint('PLANNER_YIELD_WEIGHT', 4),
+        )
+
+    def skip(self, case_type, days):
+        """Exclude already-crawled days from the walk for a case type"""
+        self.skip_days[case_type] = set(days)
+
+    def _window_from(self, case_type, start, days):
+        """Root window of up to ``days`` days starting at ``start`` (oldest-first walk)"""
+        skipped = self.skip_days.get(case_type, ())
+        while start <= self.end and start in skipped:
+            self.stats['days_skipped'] += 1
+            start += datetime.timedelta(days=1)
+        if start > self.end:
+            return None
+
+        end = start
+        last = min(start + datetime.timedelta(days=days - 1), self.end)
+        # Stop the window short of the next skipped day
+        while end < last and end + datetime.timedelta(days=1) not in skipped:
+            end += datetime.timedelta(days=1)
+        self.stats['windows_planned'] += 1
+        return DateWindow(start, end, True)
+
+    def _window_until(self, case_type, end, days):
+        """Root window of up to ``days`` days ending at ``end`` (newest-first walk)"""
+        skipped = self.skip_days.get(case_type, ())
+        while end >= self.start and end in skipped:
+            self.stats['days_skipped'] += 1
+            end -= datetime.timedelta(days=1)
+        if end < self.start:
+            return None
+
+        start = end
+        first = max(end - datetime.timedelta(days=days - 1), self.start)
+        while start > first and start - datetime.timedelta(days=1) not in skipped:
+            start -= datetime.timedelta(days=1)
+        self.stats['windows_planned'] += 1
+        return DateWindow(start, end, True)
+
+    def first_window(self, case_type):
+        """Return the first root window for a case type, or None when nothing is left"""
+        self.widths[case_type] = self.initial_days
+        if self.newest_first:
+            return self._window_until(case_type, self.end, self.initial_days)
+        return self._window_from(case_type, self.start, self.initial_days)
+
+    def next_window(self, case_type, window):
+        """Return the root window following ``window``, or None when the walk is done"""
+        days = self.widths.get(case_type, self.initial_days)
+        if self.newest_first:
+            return self._window_until(case_type, window.start - datetime.timedelta(days=1), days)
+        return self._window_from(case_type, window.end + datetime.timedelta(days=1), days)
+
+    def seed_yields(self, yields):
+        """Start from the rows/days totals of earlier runs ({case_type: (rows, days)})"""
+        for case_type, (rows, days) in yields.items():
+            self.yields[case_type] = [rows, days]
+
+    def yield_rate(self, case_type):
+        """Rows per day seen for a case type, or None when it has never been crawled"""
+        rows, days = self.yields.get(case_type, (0, 0))
+        return rows / days if days else None
+
+    def walk_order(self, case_types):
+        """Case types ordered by yield: productive ones first, known-empty ones last"""
+        def rate(case_type):
+            known = self.yield_rate(case_type)
+            return 1.0 if known is None else known
+        return sorted(case_types, key=rate, reverse=True)
+
+    def priority(self, case_type, window):
+        """Scheduler priority (higher runs first): recent days and high-yield case types first"""
+        rate = self.yield_rate(case_type)
+        bonus = self.yield_weight * math.log2(1 + (1.0 if rate is None else rate))
+        return int(round(bonus)) - (self.end - window.end).days
+
+    def is_saturated(self, response_body, row_count):
+        """True when the result page was truncated by the server"""
+        if b'refine your query' in response_body.lower():
+            return True
+        return bool(self.row_cap) and row_count >= self.row_cap
+
+    def split(self, case_type, window):
+        """Split a saturated window and shrink future windows for the case type
+
+        Returns an empty tuple when the window is already at the minimum width.
+        """
+        self._narrow(case_type, window.days)
+        if window.days <= self.min_days:
+            self.stats['unsplittable_windows'] += 1
+            return ()
+        self.stats['windows_split'] += 1
+        return window.split()
+
+    def record(self, case_type, window, row_count):
+        """Record the yield of a completed window and widen sparse case types"""
+        totals = self.yields.setdefault(case_type, [0, 0])
+        totals[0] += row_count
+        totals[1] += window.days
+        if row_count >= self.sparse_rows:
+            return
+        width = self.widths.get(case_type, self.initial_days)
+        # Only widen on full-width root windows, so a short tail window or a
+        # split half does not undo the narrowing that produced it.
+        if window.root and window.days >= width and width < self.max_days:
+            self.widths[case_type] = min(width * 2, self.max_days)
+            self.stats['windows_widened'] += 1
+
+    def _narrow(self, case_type, days):
+        width = self.widths.get(case_type, self.initial_days)
+        narrowed = max(min(width, days) // 2, self.min_days)
+        if narrowed < width:
+            self.widths[case_type] = narrowed
+            self.stats['windows_narrowed'] += 1
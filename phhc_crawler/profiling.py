@@ -0,0 +1,258 @@
+# Opt-in hot-path profiling (PROFILING_ENABLED)
+#
+# HotPathProfiler accumulates wall and CPU time per spider callback and per
+# pipeline process_item. Callbacks are timed by CallbackProfilingMiddleware
+# (the innermost spider middleware), pipelines by ProfilingPipelineManager,
+# which ProfilingAddon installs as ITEM_PROCESSOR only when profiling is on.
+# Optionally one call in every PROFILING_SAMPLE_EVERY runs under cProfile,
+# and a tracemalloc snapshot is compared with the previous one every
+# PROFILING_TRACEMALLOC_EVERY items. At close a ranked report and a pstats
+# file are written. When disabled nothing is wrapped or replaced.
+
+import cProfile
+import functools
+import logging
+import pstats
+import time
+import tracemalloc
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines import ItemPipelineManager
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingAddon:
+    """Add-on installing ProfilingPipelineManager when PROFILING_ENABLED is set
+
+    Crawls without profiling keep Scrapy's own item processor.
+    """
+
+    def update_settings(self, settings):
+        if settings.getbool('PROFILING_ENABLED'):
+            settings.set('ITEM_PROCESSOR', 'phhc_crawler.profiling.ProfilingPipelineManager', priority='addon')
+
+
+class HotPathProfiler:
+    """Extension collecting per-callable timings, cProfile samples and memory snapshots"""
+
+    def __init__(self, sample_every=0, tracemalloc_every=0, report_file=None, stats_file=None):
+        self.sample_every = sample_every
+        self.tracemalloc_every = tracemalloc_every
+        self.report_file = report_file
+        self.stats_file = stats_file
+        # {name: [calls, wall seconds, cpu seconds]}
+        self.timings = {}
+        self.calls = 0
+        self.items = 0
+        self.profile = cProfile.Profile() if sample_every else None
+        self.sampling = False
+        self.samples = 0
+        self.memory_snapshot = None
+        self.memory_report = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROFILING_ENABLED'):
+            raise NotConfigured
+        ext = cls(
+            sample_every=settings.getint('PROFILING_SAMPLE_EVERY', 0),
+            tracemalloc_every=settings.getint('PROFILING_TRACEMALLOC_EVERY', 0),
+            report_file=settings.get('PROFILING_REPORT_FILE'),
+            stats_file=settings.get('PROFILING_STATS_FILE'),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        """The crawler's enabled profiler, or None"""
+        extensions = getattr(crawler, 'extensions', None)
+        for ext in getattr(extensions, 'middlewares', ()):
+            if isinstance(ext, cls):
+                return ext
+        return None
+
+    def spider_opened(self, spider):
+        if self.tracemalloc_every and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self):
+        """Begin timing one call; returns the token to pass to stop()"""
+        self.calls += 1
+        sample = (self.profile is not None and not self.sampling
+                  and self.calls % self.sample_every == 0)
+        if sample:
+            self.sampling = True
+            self.samples += 1
+            self.profile.enable()
+        return sample, time.perf_counter(), time.thread_time()
+
+    def stop(self, name, token):
+        sample, wall_start, cpu_start = token
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        if sample:
+            self.profile.disable()
+            self.sampling = False
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0.0, 0.0]
+        timing[0] += 1
+        timing[1] += wall
+        timing[2] += cpu
+
+    def item_processed(self, spider):
+        self.items += 1
+        if self.tracemalloc_every and self.items % self.tracemalloc_every == 0:
+            self._memory_snapshot(spider)
+
+    def _memory_snapshot(self, spider):
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        if self.memory_snapshot is not None:
+            top = snapshot.compare_to(self.memory_snapshot, 'lineno')[:10]
+            lines = [f"After {self.items} items, top allocation growth:"]
+            lines += [f"  {stat}" for stat in top]
+            self.memory_report.append('\n'.join(lines))
+            spider.logger.debug(self.memory_report[-1])
+        self.memory_snapshot = snapshot
+
+    def report_lines(self):
+        ranked = sorted(self.timings.items(), key=lambda entry: entry[1][1], reverse=True)
+        total_wall = sum(timing[1] for _, timing in ranked) or 1.0
+        lines = [
+            f"{'callable':<60} {'calls':>9} {'wall s':>10} {'cpu s':>10} {'mean ms':>9} {'wall %':>7}",
+        ]
+        for name, (calls, wall, cpu) in ranked:
+            lines.append(
+                f"{name:<60} {calls:>9} {wall:>10.3f} {cpu:>10.3f} "
+                f"{wall / calls * 1000:>9.3f} {wall / total_wall * 100:>6.1f}%"
+            )
+        return lines
+
+    def spider_closed(self, spider):
+        lines = self.report_lines()
+        spider.logger.info("Hot-path profile (cumulative, ranked by wall time):\n" + '\n'.join(lines[:11]))
+
+        if self.profile is not None and self.samples:
+            if self.stats_file:
+                self.profile.dump_stats(self.stats_file)
+            lines += ['', f"cProfile: {self.samples} sampled calls (1 in {self.sample_every})"]
+            stats = pstats.Stats(self.profile).sort_stats('cumulative')
+            lines += [
+                f"  {pstats.func_std_string(func)}: {cumtime:.3f} s cumulative, {ncalls} calls"
+                for func, (_, ncalls, _, cumtime, _) in sorted(
+                    stats.stats.items(), key=lambda entry: entry[1][3], reverse=True)[:25]
+            ]
+        if self.memory_report:
+            lines += [''] + self.memory_report
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        if self.report_file:
+            with open(self.report_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            spider.logger.info(f"Profile report written to {self.report_file}"
+                               + (f", pstats to {self.stats_file}" if self.samples and self.stats_file else ""))
+
+
+class CallbackProfilingMiddleware:
+    """Innermost spider middleware timing each callback's (generator) execution
+
+    Only the time spent producing output is counted, not what the engine
+    and pipelines do with it.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        profiler = HotPathProfiler.for_crawler(crawler)
+        if profiler is None:
+            raise NotConfigured
+        return cls(profiler)
+
+    @staticmethod
+    def _name(response, spider):
+        callback = response.request.callback if response.request is not None else None
+        return f"{spider.name}.{getattr(callback, '__name__', 'parse')}"
+
+    def process_spider_output(self, response, result, spider):
+        name = self._name(response, spider)
+        iterator = iter(result)
+        while True:
+            token = self.profiler.start()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                self.profiler.stop(name, token)
+                break
+            except BaseException:
+                self.profiler.stop(name, token)
+                raise
+            self.profiler.stop(name, token)
+            yield value
+
+    async def process_spider_output_async(self, response, result, spider):
+        name = self._name(response, spider)
+        iterator = result.__aiter__()
+        while True:
+            token = self.profiler.start()
+            try:
+                value = await iterator.__anext__()
+            except StopAsyncIteration:
+                self.profiler.stop(name, token)
+                break
+            except BaseException:
+                self.profiler.stop(name, token)
+                raise
+            self.profiler.stop(name, token)
+            yield value
+
+
+class ProfilingPipelineManager(ItemPipelineManager):
+    """ITEM_PROCESSOR timing every pipeline's process_item when profiling is on"""
+
+    profiler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # Pipelines are registered from __init__, so the profiler has to be
+        # known before the manager is instantiated
+        profiler = HotPathProfiler.for_crawler(crawler)
+        if profiler is None or not hasattr(ItemPipelineManager, '_from_settings'):
+            if profiler is not None:
+                logger.warning("Pipeline profiling is not supported by this Scrapy version")
+            return ItemPipelineManager.from_crawler(crawler)
+        manager_cls = type(cls.__name__, (cls,), {'profiler': profiler})
+        return manager_cls._from_settings(crawler.settings, crawler)
+
+    def _add_middleware(self, pipe):
+        if self.profiler is not None and hasattr(pipe, 'process_item'):
+            pipe.process_item = self._timed(pipe, pipe.process_item)
+        super()._add_middleware(pipe)
+
+    def _timed(self, pipe, process_item):
+        profiler = self.profiler
+        name = f"{type(pipe).__name__}.process_item"
+
+        @functools.wraps(process_item)
+        def wrapper(item, spider):
+            token = profiler.start()
+            try:
+                return process_item(item, spider)
+            finally:
+                # Deferred-returning pipelines are timed up to the hand-off
+                profiler.stop(name, token)
+        return wrapper
+
+    def process_item(self, item, spider):
+        if self.profiler is not None:
+            self.profiler.item_processed(spider)
+        return super().process_item(item, spider)
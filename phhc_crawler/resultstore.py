@@ -0,0 +1,187 @@
+# Indexed SQLite store of crawl results
+#
+# Every result row is upserted into a ``cases`` table keyed by its row
+# identity (dedup.item_digest), so re-crawled rows update in place. Case
+# type, decision date and case number are indexed columns; the flattened
+# "header: value" text of the row is indexed by an FTS5 table kept in sync
+# by triggers. Queried with ``scrapy query_results`` or ResultStore.query().
+
+import datetime
+import json
+import re
+import sqlite3
+import time
+
+from .dedup import item_digest
+
+
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d')
+CASE_NO_RE = re.compile(r'case\s*(no|number)', re.IGNORECASE)
+# A "quoted phrase" or a run of non-space characters
+FTS_TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def fts_query(text):
+    """FTS5 query matching rows that contain every term of ``text``
+
+    Each word (or "quoted phrase") becomes an FTS5 phrase, so case numbers
+    like CRM-M-1-2026 and text with quotes or dots are searched literally
+    instead of being read as column filters or operators.
+    """
+    phrases = []
+    for phrase, word in FTS_TERM_RE.findall(text):
+        term = phrase or word
+        if term.strip():
+            phrases.append('"' + term.replace('"', '""') + '"')
+    return ' '.join(phrases)
+
+
+class ResultStore:
+    """SQLite database of result rows with B-tree and full-text indexes"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cases (
+            id            INTEGER PRIMARY KEY,
+            row_key       INTEGER NOT NULL UNIQUE,
+            case_type     TEXT,
+            case_no       TEXT,
+            decision_date TEXT,
+            date          TEXT,
+            columns       TEXT NOT NULL,
+            links         TEXT NOT NULL,
+            order_files   TEXT,
+            text          TEXT NOT NULL,
+            updated_at    REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cases_case_type_date ON cases (case_type, decision_date);
+        CREATE INDEX IF NOT EXISTS cases_date ON cases (decision_date);
+        CREATE INDEX IF NOT EXISTS cases_case_no ON cases (case_no);
+    """
+
+    # External-content FTS5 index over cases.text, maintained by triggers
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS cases_fts USING fts5(
+            text, content='cases', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS cases_ai AFTER INSERT ON cases BEGIN
+            INSERT INTO cases_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS cases_ad AFTER DELETE ON cases BEGIN
+            INSERT INTO cases_fts (cases_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS cases_au AFTER UPDATE OF text ON cases BEGIN
+            INSERT INTO cases_fts (cases_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO cases_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+    """
+
+    UPSERT = """
+        INSERT INTO cases (row_key, case_type, case_no, decision_date, date, columns, links,
+                           order_files, text, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (row_key) DO UPDATE SET
+            case_type = excluded.case_type, case_no = excluded.case_no,
+            decision_date = excluded.decision_date, date = excluded.date,
+            columns = excluded.columns, links = excluded.links,
+            order_files = COALESCE(excluded.order_files, cases.order_files),
+            text = excluded.text, updated_at = excluded.updated_at
+    """
+
+    def __init__(self, path, check_same_thread=True):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        try:
+            self.conn.executescript(self.FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: text queries fall back to LIKE
+            self.fts = False
+        self.conn.commit()
+
+    @staticmethod
+    def row(case_type, date, columns, links, order_files=None):
+        """UPSERT parameters for one result row"""
+        columns = columns or {}
+        links = list(links or ())
+        decision_date = parse_date(date)
+        if decision_date is None:
+            decision_date = next((parse_date(value) for header, value in columns.items()
+                                  if 'date' in header.lower() and parse_date(value)), None)
+        case_no = next((value for header, value in columns.items() if CASE_NO_RE.search(header)), None)
+        return (
+            item_digest({'case_type': case_type, 'columns': columns, 'links': links}),
+            case_type,
+            case_no,
+            decision_date.isoformat() if decision_date else None,
+            date,
+            json.dumps(dict(columns.items()), ensure_ascii=False),
+            json.dumps(links),
+            json.dumps(order_files) if order_files else None,
+            '\n'.join(f"{header}: {value}" for header, value in columns.items() if value),
+            time.time(),
+        )
+
+    def upsert_many(self, rows):
+        """Upsert UPSERT parameter tuples in one transaction"""
+        with self.conn:
+            self.conn.executemany(self.UPSERT, rows)
+
+    def query(self, case_type=None, date_from=None, date_to=None, case_no=None, text=None, limit=100):
+        """Rows matching every given filter, newest decision date first, as dicts"""
+        clauses, params = [], []
+        if case_type:
+            clauses.append("c.case_type = ?")
+            params.append(case_type)
+        if date_from:
+            clauses.append("c.decision_date >= ?")
+            params.append(date_from.isoformat())
+        if date_to:
+            clauses.append("c.decision_date <= ?")
+            params.append(date_to.isoformat())
+        if case_no:
+            clauses.append("c.case_no = ?")
+            params.append(case_no)
+        source = "cases AS c"
+        if text and text.strip():
+            if self.fts:
+                source = "cases_fts JOIN cases AS c ON c.id = cases_fts.rowid"
+                clauses.append("cases_fts MATCH ?")
+                params.append(fts_query(text))
+            else:
+                clauses.append("c.text LIKE ?")
+                params.append(f"%{text}%")
+        sql = (f"SELECT c.case_type, c.case_no, c.decision_date, c.date, c.columns, c.links, c.order_files "
+               f"FROM {source}")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY c.decision_date DESC, c.id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [
+            {
+                'case_type': case_type_, 'case_no': case_no_, 'decision_date': decision_date,
+                'date': date, 'columns': json.loads(columns), 'links': json.loads(links),
+                'order_files': json.loads(order_files) if order_files else None,
+            }
+            for case_type_, case_no_, decision_date, date, columns, links, order_files
+            in self.conn.execute(sql, params)
+        ]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
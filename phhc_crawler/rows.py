@@ -0,0 +1,88 @@
+# Compact result-table rows
+#
+# Every row of a results page has the same headers, so they are kept once in
+# an interned RowSchema and each row only stores a tuple of cell values.
+# RowColumns is a read-only Mapping over (schema, values): code that reads
+# ``columns[header]`` or ``columns.items()`` works unchanged, and its repr
+# matches the dict it replaces, so exports render identically.
+
+import sys
+from collections.abc import Mapping
+
+
+class RowSchema:
+    """Interned, ordered header tuple with a header -> position index"""
+
+    __slots__ = ('headers', 'index')
+
+    _interned = {}
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.index = {header: i for i, header in enumerate(headers)}
+
+    @classmethod
+    def intern(cls, headers):
+        """The shared schema for these headers"""
+        headers = tuple(headers)
+        schema = cls._interned.get(headers)
+        if schema is None:
+            schema = cls._interned[headers] = cls(tuple(sys.intern(h) for h in headers))
+        return schema
+
+    def __reduce__(self):
+        # Re-intern on unpickling (rows coming back from a parse pool worker)
+        return (RowSchema.intern, (self.headers,))
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __repr__(self):
+        return f"RowSchema({self.headers!r})"
+
+
+class RowColumns(Mapping):
+    """Read-only header -> value mapping backed by a schema and a value tuple"""
+
+    __slots__ = ('schema', 'values_')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values_ = tuple(values)
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build from (header, value) pairs with dict semantics for repeated headers"""
+        columns = dict(pairs)
+        return cls(RowSchema.intern(columns), columns.values())
+
+    def __getitem__(self, header):
+        return self.values_[self.schema.index[header]]
+
+    def __contains__(self, header):
+        return header in self.schema.index
+
+    def __iter__(self):
+        return iter(self.schema.headers)
+
+    def __len__(self):
+        return len(self.values_)
+
+    def items(self):
+        return zip(self.schema.headers, self.values_)
+
+    def values(self):
+        return self.values_
+
+    def __eq__(self, other):
+        if isinstance(other, RowColumns) and other.schema is self.schema:
+            return self.values_ == other.values_
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{' + ', '.join(f'{h!r}: {v!r}' for h, v in zip(self.schema.headers, self.values_)) + '}'
+
+    def __reduce__(self):
+        return (RowColumns, (self.schema, self.values_))
@@ -4,6 +4,7 @@
 BOT_NAME = "phhc_crawler"
 SPIDER_MODULES = ["phhc_crawler.spiders"]
 NEWSPIDER_MODULE = "phhc_crawler.spiders"
+COMMANDS_MODULE = "phhc_crawler.commands"
 
 # ============================================================================
 # CRITICAL PERFORMANCE OPTIMIZATION SETTINGS
@@ -13,20 +14,39 @@ NEWSPIDER_MODULE = "phhc_crawler.spiders"
 CONCURRENT_REQUESTS = 100
 
 # High single-domain concurrency (from 1 to 50) - MAJOR BOTTLENECK FIX
+# With AIMD enabled this is only the ceiling; the live limit adapts
 CONCURRENT_REQUESTS_PER_DOMAIN = 50
 
-# Optimized download delay (from 1 to 0.1 seconds)
-DOWNLOAD_DELAY = 0.1
+# No fixed delay: a non-zero DOWNLOAD_DELAY lets a slot start only one
+# request per delay, capping it at 1/DOWNLOAD_DELAY requests/second no
+# matter what the concurrency is. Pacing is left to the AIMD controller.
+DOWNLOAD_DELAY = 0
 
 # Enhanced reactor thread pool for better DNS/IO handling
 REACTOR_THREADPOOL_MAXSIZE = 50
 
 # ============================================================================
-# AUTOTHROTTLE - ADAPTIVE PERFORMANCE TUNING
+# AIMD CONCURRENCY CONTROL - ADAPTIVE PERFORMANCE TUNING
 # ============================================================================
 
-# Enable AutoThrottle for intelligent performance adaptation
-AUTOTHROTTLE_ENABLED = True
+# Feedback-driven in-flight limit per download slot: +1 per clean round
+# trip, halved on backpressure (rising latency, 429/503, timeouts,
+# "refine your query" or empty pages). Current limit: aimd/* crawl stats.
+AIMD_ENABLED = True
+AIMD_START_CONCURRENCY = 8
+AIMD_MIN_CONCURRENCY = 1
+AIMD_MAX_CONCURRENCY = 50
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_LATENCY_FACTOR = 2.0  # backpressure when latency EWMA > 2x its baseline
+AIMD_BASELINE_DECAY = 0.01  # baseline (lowest latency EWMA) drifts up 1% of the gap per response
+AIMD_COOLDOWN = 5.0        # seconds between two decreases
+AIMD_BACKOFF_HTTP_CODES = [429, 503]
+AIMD_BACKOFF_MARKERS = ["refine your query"]
+AIMD_MIN_BODY_BYTES = 200  # smaller 200 responses (not order documents) count as empty error pages
+
+# AutoThrottle adjusts delays against the same signal and fights the AIMD
+# controller, so it stays off while AIMD_ENABLED is set
+AUTOTHROTTLE_ENABLED = False
 AUTOTHROTTLE_START_DELAY = 0.1
 AUTOTHROTTLE_MAX_DELAY = 3
 AUTOTHROTTLE_TARGET_CONCURRENCY = 8.0
@@ -39,7 +59,8 @@ AUTOTHROTTLE_DEBUG = False  # Set to True for debugging performance issues
 # Disable robots.txt checking (major performance killer)
 ROBOTSTXT_OBEY = False
 
-# Disable cookies (not needed for this use case)
+# Scrapy's single cookie jar stays off: search-form sessions are handled
+# by SessionPoolMiddleware (SESSION POOL below)
 COOKIES_ENABLED = False
 
 # Disable redirect middleware if not needed
@@ -53,8 +74,22 @@ COOKIES_ENABLED = False
 DNSCACHE_ENABLED = True
 DNSCACHE_SIZE = 10000
 
-# Disable HTTP cache to save memory (enable only if needed)
-HTTPCACHE_ENABLED = False
+# HTTP cache for search results: days older than HTTPCACHE_IMMUTABLE_AFTER_DAYS
+# are served from the cache permanently, recent days are refetched after
+# HTTPCACHE_RECENT_TTL seconds and the case-type listing after a day
+HTTPCACHE_ENABLED = True
+HTTPCACHE_POLICY = "phhc_crawler.httpcache.PHHCCachePolicy"
+HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_EXPIRATION_SECS = 0  # expiry is decided by the policy
+HTTPCACHE_GZIP = True
+HTTPCACHE_IGNORE_HTTP_CODES = [429, 500, 502, 503, 504]
+HTTPCACHE_IMMUTABLE_AFTER_DAYS = 7
+HTTPCACHE_RECENT_TTL = 3600
+HTTPCACHE_LISTING_TTL = 86400
+
+# POST searches are keyed on their canonicalized formdata
+REQUEST_FINGERPRINTER_CLASS = "phhc_crawler.fingerprint.FormRequestFingerprinter"
 
 # Memory usage optimization
 MEMDEBUG_ENABLED = False
@@ -79,6 +114,101 @@ RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 429]
 DOWNLOAD_WARNSIZE = 33554432  # 32MB
 DOWNLOAD_MAXSIZE = 104857600  # 100MB
 
+# ============================================================================
+# QUERY PLANNER - ADAPTIVE DATE WINDOWS
+# ============================================================================
+
+# Days covered by the crawl, ending yesterday
+PLANNER_LOOKBACK_DAYS = 61
+
+# Width of the first window per case type; halves on "refine your query",
+# doubles while a case type keeps returning fewer than PLANNER_SPARSE_ROWS
+PLANNER_INITIAL_WINDOW_DAYS = 16
+PLANNER_MIN_WINDOW_DAYS = 1
+PLANNER_MAX_WINDOW_DAYS = 61
+PLANNER_SPARSE_ROWS = 20
+
+# Treat a first page with this many rows as truncated (0 disables the check)
+PLANNER_ROW_CAP = 500
+
+# Walk each case type from yesterday backwards, so recent days come first
+PLANNER_NEWEST_FIRST = True
+
+# Scheduler priority = PLANNER_YIELD_WEIGHT * log2(1 + rows/day of the case
+# type, from crawl_state.sqlite3 and this run) - age of the window in days
+PLANNER_YIELD_WEIGHT = 4
+
+# Case types walked at the same time (0 = all); the rest start as walks
+# finish, keeping the scheduler backlog - and memory - flat
+PLANNER_MAX_ACTIVE_WALKS = 32
+
+# ============================================================================
+# PAGINATION
+# ============================================================================
+
+# Form field carrying the page number when "Next" is script-driven
+PAGINATION_PAGE_PARAM = "page"
+
+# Stop paginating a single query after this many pages
+PAGINATION_MAX_PAGES = 200
+
+# ============================================================================
+# INCREMENTAL CRAWL STATE
+# ============================================================================
+
+# SQLite ledger of completed (case_type, date window, page) units
+LEDGER_PATH = "crawl_state.sqlite3"
+LEDGER_COMMIT_EVERY = 50
+
+# With -a incremental=1, days older than this are skipped once complete
+LEDGER_RECHECK_DAYS = 7
+
+# ============================================================================
+# SHARDED CRAWL (scrapy shard_crawl --workers N)
+# ============================================================================
+
+# Work units are leased from a shared SQLite queue; a lease that is not
+# renewed within SHARD_LEASE_SECONDS goes back to the other workers
+SHARD_UNITS_IN_FLIGHT = 4
+SHARD_LEASE_SECONDS = 120
+SHARD_HEARTBEAT_SECONDS = 30
+SHARD_MAX_ATTEMPTS = 3
+
+# ============================================================================
+# DEAD LETTERS (scrapy crawl ... -a replay=1, scrapy dead_letters)
+# ============================================================================
+
+# Search and result page requests that still fail after RETRY_TIMES are
+# recorded with their error, attempt count and last status, so the gaps can
+# be re-crawled on their own instead of re-running the whole crawl
+DEAD_LETTER_ENABLED = True
+DEAD_LETTER_PATH = "dead_letters.sqlite3"
+# Entries that fail this many replays are marked failed and left alone
+DEAD_LETTER_MAX_REPLAYS = 3
+
+# Applied on top of these settings in replay runs: fewer parallel requests,
+# more patience, and a feed of their own instead of overwriting results_backup.csv
+DEAD_LETTER_REPLAY_SETTINGS = {
+    "CONCURRENT_REQUESTS": 4,
+    "CONCURRENT_REQUESTS_PER_DOMAIN": 2,
+    "AIMD_START_CONCURRENCY": 1,
+    "AIMD_MAX_CONCURRENCY": 2,
+    "DOWNLOAD_TIMEOUT": 90,
+    "RETRY_TIMES": 5,
+    "FEEDS": {
+        "results_replay.csv": {"format": "csv", "encoding": "utf8", "overwrite": True},
+    },
+}
+
+# ============================================================================
+# RESULT PAGE PARSING
+# ============================================================================
+
+# Parse result pages in this many worker processes instead of on the reactor
+# thread (0 = parse in-process). Worth it when pages are large and
+# CONCURRENT_REQUESTS is high; each worker costs one Python process.
+PARSE_POOL_WORKERS = 0
+
 # ============================================================================
 # PIPELINE CONFIGURATION
 # ============================================================================
@@ -86,9 +216,68 @@ DOWNLOAD_MAXSIZE = 104857600  # 100MB
 # Configure item pipelines with performance monitoring
 ITEM_PIPELINES = {
     "phhc_crawler.pipelines.PerformancePipeline": 100,
+    "phhc_crawler.pipelines.DataValidationPipeline": 200,
+    "phhc_crawler.pipelines.OrderDownloadPipeline": 250,
     "phhc_crawler.pipelines.OptimizedExcelExportPipeline": 300,
+    "phhc_crawler.pipelines.ParquetExportPipeline": 310,
+    "phhc_crawler.pipelines.SQLiteResultsPipeline": 320,
 }
 
+# Columnar output for analytics: results_parquet/case_type=<ct>/month=<YYYY-MM>/
+# part-*.parquet, appended to across runs. Table headers become col_<header>
+# string columns; new headers extend _schema.json without rewriting old
+# files. Load with phhc_crawler.parquetstore.read_dataset("results_parquet").
+PARQUET_EXPORT_ENABLED = True
+PARQUET_DATASET_DIR = "results_parquet"
+PARQUET_ROW_GROUP_SIZE = 5000
+PARQUET_MAX_OPEN_FILES = 64
+
+# Indexed results database: rows are upserted by row identity, with indexes
+# on case type, decision date and case number and an FTS5 index over the
+# row text. Query it with e.g.
+#   scrapy query_results --case-type CRM-M --from 01/03/2024 --to 31/03/2024 --text bail
+RESULTS_DB_ENABLED = True
+RESULTS_DB_PATH = "results.sqlite3"
+
+# ============================================================================
+# DUPLICATE DETECTION
+# ============================================================================
+
+# In-memory digest set (per run). For incremental crawls switch to the
+# persistent index so rows re-checked on later runs are not exported twice:
+# DEDUP_BACKEND = "phhc_crawler.dedup.DiskDedupStore"
+DEDUP_BACKEND = "phhc_crawler.dedup.MemoryDedupStore"
+DEDUP_INITIAL_CAPACITY = 65536
+
+# DiskDedupStore options. DEDUP_BLOOM_CAPACITY > 0 (e.g. 5000000) puts a
+# Bloom filter in front of the index, so rows it has never seen skip the
+# lookup and are written in batches: worth it once the index outgrows the
+# page cache, but not when several processes share DEDUP_PATH
+DEDUP_PATH = "dedup_index.sqlite3"
+DEDUP_BLOOM_CAPACITY = 0
+DEDUP_BLOOM_ERROR_RATE = 0.001
+DEDUP_COMMIT_EVERY = 1000
+
+# Micro-batch validation (0 = per item): DataValidationPipeline holds up to
+# VALIDATION_BATCH_SIZE items, or VALIDATION_BATCH_INTERVAL seconds' worth,
+# and strips, date-parses and checks them as columns
+VALIDATION_BATCH_SIZE = 0
+VALIDATION_BATCH_INTERVAL = 0.05
+
+# ============================================================================
+# ORDER DOCUMENT DOWNLOADS
+# ============================================================================
+
+# "View Order" documents are downloaded through the engine (so replay,
+# cache, retries and throttling apply), streamed to disk as they arrive,
+# into a content-addressed store (orders/<sha256[:2]>/<sha256>.pdf) and
+# indexed by URL, so re-runs skip them
+ORDER_DOWNLOAD_ENABLED = True
+ORDER_STORE_DIR = "orders"
+ORDER_DOWNLOAD_CONCURRENCY = 8
+ORDER_DOWNLOAD_PER_HOST = 4
+ORDER_DOWNLOAD_MAXSIZE = 104857600  # 100MB, enforced by the downloader (download_maxsize)
+
 # ============================================================================
 # LOGGING AND MONITORING
 # ============================================================================
@@ -98,9 +287,68 @@ LOG_FILE = "crawl.log"
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(levelname)s: %(message)s"
 
+# Queue-based logging: records are filtered and enqueued on the reactor
+# thread and written by a listener thread as JSON lines to LOG_JSON_FILE
+# (and to LOG_FILE as well with LOG_QUEUE_TEXT_LOG). Tagged events are
+# sampled (share of records kept) and rate limited (records per second);
+# their counts per case type are logged every LOG_SUMMARY_INTERVAL seconds.
+# E.g. scrapy crawl ... -s LOG_QUEUE_ENABLED=1
+LOG_QUEUE_ENABLED = False
+LOG_JSON_FILE = "crawl.jsonl"
+LOG_QUEUE_TEXT_LOG = True
+LOG_SAMPLE_RATES = {
+    "row_extracted": 0.001,
+    "results_page": 0.01,
+    "window_split": 0.1,
+}
+LOG_RATE_LIMITS = {
+    "refine_query": 5,
+    "search_failed": 5,
+}
+LOG_SUMMARY_INTERVAL = 60
+
 # Disable unnecessary stats
 STATS_CLASS = 'scrapy.statscollectors.MemoryStatsCollector'
 
+# Per-case-type / per-date metrics: latency, response size, parse time and
+# items per response histograms, refine-query hits and queue depths.
+# Snapshots are appended to METRICS_SNAPSHOT_FILE every METRICS_INTERVAL
+# seconds; the first free port of METRICS_HTTP_PORT serves them to
+# Prometheus at http://127.0.0.1:<port>/metrics (empty list: no endpoint).
+METRICS_ENABLED = True
+METRICS_INTERVAL = 30
+METRICS_SNAPSHOT_FILE = "metrics.jsonl"
+METRICS_HTTP_PORT = [9410, 9430]
+METRICS_HTTP_HOST = "127.0.0.1"
+
+EXTENSIONS = {
+    "phhc_crawler.metrics.CrawlMetrics": 500,
+    "phhc_crawler.profiling.HotPathProfiler": 510,
+    "phhc_crawler.jsonlog.QueueLogging": 520,
+}
+
+# Times spider callbacks for the parse_seconds / items_per_response metrics;
+# sits closest to the spider so other middlewares are not counted
+SPIDER_MIDDLEWARES = {
+    "phhc_crawler.metrics.ParseTimingMiddleware": 999,
+    "phhc_crawler.profiling.CallbackProfilingMiddleware": 1000,
+}
+
+# Hot-path profiling (off by default): cumulative wall/CPU time per spider
+# callback and per pipeline process_item, ranked in PROFILING_REPORT_FILE at
+# close. PROFILING_SAMPLE_EVERY=N also runs 1 call in N under cProfile
+# (saved to PROFILING_STATS_FILE); PROFILING_TRACEMALLOC_EVERY=N compares
+# memory snapshots every N items. E.g. scrapy crawl ... -s PROFILING_ENABLED=1
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_EVERY = 0
+PROFILING_TRACEMALLOC_EVERY = 0
+PROFILING_REPORT_FILE = "profile_report.txt"
+PROFILING_STATS_FILE = "profile.pstats"
+# Installs the profiling ITEM_PROCESSOR, only when PROFILING_ENABLED is set
+ADDONS = {
+    "phhc_crawler.profiling.ProfilingAddon": 0,
+}
+
 # ============================================================================
 # DATA EXPORT CONFIGURATION
 # ============================================================================
@@ -116,6 +364,17 @@ FEEDS = {
 
 FEED_EXPORT_ENCODING = "utf-8"
 
+# Excel and Parquet exports write on a background thread: items are queued
+# (at most EXPORT_WRITER_QUEUE_SIZE; beyond that the scraper waits for the
+# writer) and written in batches of up to EXPORT_WRITER_BATCH_SIZE rows
+EXPORT_WRITER_QUEUE_SIZE = 10000
+EXPORT_WRITER_BATCH_SIZE = 500
+EXPORT_WRITER_FLUSH_INTERVAL = 1.0  # seconds a partial batch may wait
+
+# phhc_judgments_chunked sorts its CSV with an external merge sort; rows per
+# sorted run file (bounds memory during the crawl)
+EXPORT_SORT_RUN_SIZE = 50000
+
 # ============================================================================
 # USER AGENT AND HEADERS
 # ============================================================================
@@ -133,9 +392,47 @@ DEFAULT_REQUEST_HEADERS = {
 }
 
 # ============================================================================
-# MIDDLEWARE CONFIGURATION (Optional - Uncomment if needed)
+# MIDDLEWARE CONFIGURATION
 # ============================================================================
 
+# Record/replay sits just before decompression, so archived bodies are
+# already decoded and replayed responses skip the downloader entirely.
+# AIMD sits below it to see decoded bodies and raw statuses before retries.
+# The session pool comes first so its per-session download slots (if any)
+# are set before AIMD looks the slot up.
+DOWNLOADER_MIDDLEWARES = {
+    "phhc_crawler.middlewares.SessionPoolMiddleware": 560,
+    "phhc_crawler.middlewares.AIMDConcurrencyMiddleware": 570,
+    "phhc_crawler.middlewares.RecordReplayMiddleware": 585,
+}
+
+# "off", "record" (archive every response) or "replay" (serve from archive,
+# never touch the network) - e.g. scrapy crawl ... -s REPLAY_MODE=replay
+REPLAY_MODE = "off"
+REPLAY_ARCHIVE = "replay_archive.sqlite3"
+REPLAY_IGNORE_HTTP_CODES = [429, 500, 502, 503, 504]
+
+# ============================================================================
+# SESSION POOL
+# ============================================================================
+
+# Warm sessions (one cookie jar each, from a GET of home.php) that requests
+# are spread over. An empty or "session expired" page re-warms the session
+# in the background and retries the request on another one.
+SESSION_POOL_ENABLED = True
+SESSION_POOL_SIZE = 4
+SESSION_WARMUP_URL = None      # default: the spider's start URL
+SESSION_MIN_BODY_BYTES = 1     # an empty 200 response means the session was dropped
+SESSION_INVALID_MARKERS = ["session expired", "session has expired", "invalid session"]
+SESSION_MAX_AGE = 900          # seconds before a session is proactively refreshed
+SESSION_MAX_RETRIES = 2
+SESSION_WARMUP_RETRY_DELAY = 5.0
+SESSION_WARMUP_MAX_FAILURES = 5  # then requests go out without a session
+# One download slot (and AIMD limit) per session instead of one per domain
+SESSION_DOWNLOAD_SLOTS = False
+
+# Optional middlewares (uncomment if needed)
+
 # Enable rotating user agents if getting blocked
 # DOWNLOADER_MIDDLEWARES = {
 #     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
@@ -167,11 +464,11 @@ DEFAULT_REQUEST_HEADERS = {
 # - Total runtime: 5-10 minutes (down from 30 minutes)
 
 # Troubleshooting if blocked:
-# 1. Reduce CONCURRENT_REQUESTS to 50
-# 2. Increase DOWNLOAD_DELAY to 0.5
-# 3. Enable AUTOTHROTTLE_DEBUG = True
+# 1. Lower AIMD_MAX_CONCURRENCY (or AIMD_START_CONCURRENCY)
+# 2. Lower AIMD_LATENCY_FACTOR so latency growth backs off sooner
+# 3. Check the aimd/backpressure/* stats to see what is triggering backoff
 # 4. Consider enabling proxy rotation
 
 # Memory usage:
 # - Expected: 2-4GB during peak operation
-# - If memory issues: Reduce CONCURRENT_REQUESTS to 50
\ No newline at end of file
+# - If memory issues: Reduce CONCURRENT_REQUESTS to 50 or PLANNER_MAX_ACTIVE_WALKS
\ No newline at end of file
@@ -1,7 +1,20 @@
 import scrapy
 import os
 import datetime
-import re
+from collections import deque
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from ..deadletter import DeadLetterStore
+from ..extractors import parse_search_form, parse_search_page
+from ..items import CaseRowItem
+from ..ledger import CrawlLedger
+from ..pagination import Paginator
+from ..parsepool import ParsePool
+from ..planner import QueryPlanner
+from ..workqueue import WorkQueue, WorkUnitLeaser
 
 class PHHCCaseSpider(scrapy.Spider):
     custom_settings = {
@@ -15,14 +28,41 @@ class PHHCCaseSpider(scrapy.Spider):
     allowed_domains = ["phhc.gov.in"]
     start_url = "https://www.phhc.gov.in/home.php?search_param=free_text_search_judgment"
 
-    def date_range_last_two_months(self):
-        today = datetime.datetime.today()  # Use fixed current time for reproducibility
-        two_months_ago = today - datetime.timedelta(days=61)
-        for n in range((today - two_months_ago).days):
-            day = two_months_ago + datetime.timedelta(days=n)
-            yield day.strftime('%d/%m/%Y')
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        if cls.is_flag(kwargs.get('replay')):
+            # Replays run under their own, gentler policy; -s options still win
+            crawler.settings.setdict(crawler.settings.getdict('DEAD_LETTER_REPLAY_SETTINGS'), priority='spider')
+        return super().from_crawler(crawler, *args, **kwargs)
+
+    @staticmethod
+    def is_flag(value):
+        return str(value).lower() in ('1', 'true', 'yes')
+
+    def __init__(self, incremental=False, queue=None, worker=None, replay=False, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # scrapy crawl phhc_case_form_dynamic -a incremental=1
+        self.incremental = self.is_flag(incremental)
+        # scrapy crawl phhc_case_form_dynamic -a replay=1: only re-crawl dead letters
+        self.replay = self.is_flag(replay)
+        self.ledger = None
+        self.dead_letters = None
+        # Set by scrapy shard_crawl: lease (case_type, window) units from a shared queue
+        self.queue_path = queue
+        self.worker = worker or f"worker-{os.getpid()}"
+        self.leaser = None
+        # Case types whose date walk has not started yet (see start_walks),
+        # and those with a root window in flight
+        self.pending_walks = deque()
+        self.active_walks = set()
+        self.parse_pool = None
+        self.results_callback = self.save_response
 
     def start_requests(self):
+        # -s PARSE_POOL_WORKERS=N: parse result pages in N worker processes
+        self.parse_pool = ParsePool.from_settings(self.settings)
+        if self.parse_pool is not None:
+            self.results_callback = self.save_response_pooled
         yield scrapy.Request(
             url=self.start_url,
             callback=self.parse_case_types,
@@ -30,74 +70,258 @@ class PHHCCaseSpider(scrapy.Spider):
         )
 
     def parse_case_types(self, response):
-        # Restore logic to use all case types
-        case_types = response.css('select[name="t_case_type"] option::attr(value)').getall()
-        case_types = [ct for ct in case_types if ct.strip() != '']
+        case_types = parse_search_form(response.selector)
         self.logger.info(f"Found {len(case_types)} case types: {case_types}")
 
-        for case_type in case_types:
-            for day in self.date_range_last_two_months():
-                formdata = {
-                    'from_date': day,
-                    'to_date': day,
-                    'pet_name': '',
-                    'res_name': '',
-                    'free_text': '',
-                    't_case_type': case_type,
-                    't_case_year': '',
-                    'submit': 'Search Case',
-                }
-                yield scrapy.FormRequest(
-                    url=self.start_url,
-                    formdata=formdata,
-                    callback=self.save_response,
-                    cb_kwargs={'case_type': case_type, 'day': day},
-                    dont_filter=True
-                )
-
-    def save_response(self, response, case_type, day):
-        from ..items import PhhcCrawlerItem
-
-        # Log if 'refine your query' appears in the response
-        if b'refine your query' in response.body.lower():
-            self.logger.warning(f"'Refine your query' found for case_type={case_type}, date={day}, url={response.url}")
-
-        table = response.css('table#tables11')
-        headers = table.css('tr th::text').getall()
-        rows = table.css('tr')[1:]  # skip header row
+        # Each case type walks the lookback period with adaptive date windows;
+        # follow-up windows are scheduled from save_response as results arrive.
+        self.planner = QueryPlanner.from_settings(self.settings)
+        self.ledger = CrawlLedger.from_settings(self.settings)
+        self.paginator = Paginator.from_settings(self.settings, self.logger)
+
+        if self.queue_path:
+            # Sharded mode: the coordinator already split the work into units
+            # (and left completed days out of them for incremental crawls)
+            if self.incremental:
+                self.logger.info("Incremental crawl: days completed before were left out of the work queue")
+            self.leaser = WorkUnitLeaser(
+                self,
+                WorkQueue(self.queue_path, max_attempts=self.settings.getint('SHARD_MAX_ATTEMPTS', 3)),
+                self.worker,
+                build_requests=lambda case_type, window: [self.build_search_request(case_type, window)],
+                units_in_flight=self.settings.getint('SHARD_UNITS_IN_FLIGHT', 4),
+                lease_seconds=self.settings.getint('SHARD_LEASE_SECONDS', 120),
+                heartbeat_interval=self.settings.getint('SHARD_HEARTBEAT_SECONDS', 30),
+            )
+            yield from self.leaser.lease_requests()
+            return
+
+        # Failed units of a sharded crawl stay in the work queue instead
+        if self.settings.getbool('DEAD_LETTER_ENABLED') or self.replay:
+            self.dead_letters = DeadLetterStore.from_settings(self.settings)
+        if self.replay:
+            yield from self.replay_requests()
+            return
+
+        if self.incremental:
+            # Only days older than the re-check window are trusted as final
+            recheck_days = self.settings.getint('LEDGER_RECHECK_DAYS', 7)
+            cutoff = self.planner.end - datetime.timedelta(days=recheck_days - 1)
+            for case_type in case_types:
+                self.planner.skip(case_type, self.ledger.completed_days(case_type, cutoff))
+            self.logger.info(f"Incremental crawl: re-checking days from {cutoff:%d/%m/%Y}")
+
+        # Walks are started lazily, most productive case types first, so
+        # only PLANNER_MAX_ACTIVE_WALKS case types have searches queued
+        self.planner.seed_yields(self.ledger.yields())
+        self.pending_walks = deque(self.planner.walk_order(case_types))
+        self.max_active_walks = self.settings.getint('PLANNER_MAX_ACTIVE_WALKS', 32) or len(case_types)
+        self.crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        self.crawler.signals.connect(self.request_dropped, signal=signals.request_dropped)
+        yield from self.start_walks()
+
+    def start_walks(self):
+        """First requests of pending case types, up to the active walk limit"""
+        while self.pending_walks and len(self.active_walks) < self.max_active_walks:
+            case_type = self.pending_walks.popleft()
+            window = self.planner.first_window(case_type)
+            if window is not None:
+                self.active_walks.add(case_type)
+                yield self.build_search_request(case_type, window)
+
+    def request_dropped(self, request, spider):
+        # A dropped root window would end its walk: carry on with the next one
+        window = request.cb_kwargs.get('window')
+        if window is None or not window.root or request.cb_kwargs.get('page', 1) != 1:
+            return
+        case_type = request.cb_kwargs['case_type']
+        self.logger.warning("Search dropped: case_type=%s, window=%s, continuing the walk", case_type, window,
+                            extra={'event': 'search_dropped', 'case_type': case_type})
+        for next_request in self.schedule_next_window(case_type, window):
+            self.crawler.engine.crawl(next_request)
+
+    def spider_idle(self, spider):
+        # Failed and dropped root windows hand over to the next window, so a
+        # walk still active here lost its request some other way (e.g. an
+        # exception in a callback): nothing will ever end it
+        if self.active_walks:
+            lost = sorted(self.active_walks)
+            self.logger.warning("Walks lost without finishing: %s", lost, extra={'event': 'walks_lost'})
+            self.crawler.stats.inc_value('planner/walks_lost', len(lost))
+            self.active_walks.clear()
+        if not self.pending_walks:
+            return
+        for request in self.start_walks():
+            self.crawler.engine.crawl(request)
+        raise DontCloseSpider
+
+    def replay_requests(self):
+        """Re-send every pending dead letter exactly as it was first sent"""
+        pending = self.dead_letters.pending()
+        self.logger.info(f"Replaying {len(pending)} dead-lettered requests from {self.dead_letters.path}")
+        for entry_id, case_type, window, page, method, url, body in pending:
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if method == 'POST' else None
+            yield scrapy.Request(
+                url,
+                method=method,
+                body=body,
+                headers=headers,
+                callback=self.results_callback,
+                errback=self.search_failed,
+                cb_kwargs={'case_type': case_type, 'window': window, 'page': page},
+                meta={'dead_letter': entry_id},
+                dont_filter=True,
+            )
+
+    def search_failed(self, failure):
+        """Errback of search and result page requests that exhausted their retries"""
+        request = failure.request
+        case_type = request.cb_kwargs['case_type']
+        window = request.cb_kwargs['window']
+        page = request.cb_kwargs.get('page', 1)
+        self.logger.warning("Search failed: case_type=%s, window=%s, page=%s (%s: %s)",
+                            case_type, window, page, failure.type.__name__, failure.getErrorMessage(),
+                            extra={'event': 'search_failed', 'case_type': case_type})
+        if self.dead_letters is not None:
+            self.dead_letters.add(request, failure, case_type, window, page)
+            self.crawler.stats.inc_value('dead_letter/recorded')
+        # Keep walking past the failed window instead of ending the case type
+        if page == 1 and window.root:
+            yield from self.schedule_next_window(case_type, window)
+
+    def search_formdata(self, case_type, window):
+        return {
+            'from_date': window.from_date,
+            'to_date': window.to_date,
+            'pet_name': '',
+            'res_name': '',
+            'free_text': '',
+            't_case_type': case_type,
+            't_case_year': '',
+            'submit': 'Search Case',
+        }
+
+    def build_search_request(self, case_type, window):
+        # No dont_filter: POST bodies are part of the request fingerprint, so
+        # only genuinely repeated searches are dropped by the dupefilter
+        return scrapy.FormRequest(
+            url=self.start_url,
+            formdata=self.search_formdata(case_type, window),
+            callback=self.results_callback,
+            errback=self.search_failed,
+            cb_kwargs={'case_type': case_type, 'window': window},
+            priority=self.planner.priority(case_type, window),
+        )
+
+    def row_date(self, columns, window):
+        """(date, date_range) for a row: its decision date, if known
+
+        A row from a multi-day window without a date column only has the
+        window to go by: it gets the window's start date, and the window
+        itself in ``date_range``.
+        """
+        if window.days == 1:
+            return window.from_date, None
+        for header, value in columns.items():
+            if 'date' in header.lower() and value:
+                return value, None
+        return window.from_date, str(window)
+
+    def save_response(self, response, case_type, window, page=1):
+        rows, next_page = parse_search_page(response.selector, response.urljoin)
+        yield from self.handle_results(response, case_type, window, page, rows, next_page)
 
+    async def save_response_pooled(self, response, case_type, window, page=1):
+        rows, next_page = await maybe_deferred_to_future(self.parse_pool.parse(parse_search_page, response))
+        return list(self.handle_results(response, case_type, window, page, rows, next_page))
+
+    def handle_results(self, response, case_type, window, page, rows, next_page):
+        entry_id = response.meta.get('dead_letter')
+        if entry_id is not None:
+            self.dead_letters.resolve(entry_id)
+            self.crawler.stats.inc_value('dead_letter/resolved')
+        results = self.parse_search_results(response, case_type, window, page, rows, next_page)
+        if self.leaser is not None:
+            results = self.leaser.process_output(response, results)
+        return results
+
+    def parse_search_results(self, response, case_type, window, page, rows, next_page):
+        if page == 1 and self.planner.is_saturated(response.body, len(rows)):
+            halves = self.planner.split(case_type, window)
+            if halves:
+                self.logger.info("Splitting saturated window case_type=%s, window=%s", case_type, window,
+                                 extra={'event': 'window_split', 'case_type': case_type})
+                for half in halves:
+                    yield self.build_search_request(case_type, half)
+                if window.root:
+                    yield from self.schedule_next_window(case_type, window)
+                return
+            # Single-day window: nothing left to split, keep what the server returned
+            self.logger.warning("'Refine your query' found for case_type=%s, date=%s, url=%s",
+                                case_type, window, response.url,
+                                extra={'event': 'refine_query', 'case_type': case_type})
+            truncated = True
+        else:
+            truncated = response.meta.get('truncated', False)
+
+        if page == 1:
+            self.planner.record(case_type, window, len(rows))
+            if window.root:
+                yield from self.schedule_next_window(case_type, window)
+
+        # A truncated day is never complete, so incremental runs re-check it
         if not rows:
+            self.ledger.record(case_type, window, page, 0, complete=not truncated)
             return
-        for row in rows:
-            cells = row.css('td')
-            columns = {}
-            links = []
-            for i, cell in enumerate(cells):
-                # Get text
-                text = cell.css('::text').get(default='').strip()
-                columns[headers[i] if i < len(headers) else f'col_{i}'] = text
-                # Extract only "View Order" links via onclick parsing
-                for a in cell.xpath('.//a[text()="View Order"]'):
-                    onclick = a.attrib.get('OnClick') or a.attrib.get('onclick', '')
-                    m = re.search(r"window\.open\('([^']+)'\)", onclick)
-                    if m:
-                        links.append(response.urljoin(m.group(1)))
+        for columns, links in rows:
             if not links:
                 continue
-            item = PhhcCrawlerItem(
+            date, date_range = self.row_date(columns, window)
+            item = CaseRowItem(
                 case_type=case_type,
-                date=day,
+                date=date,
+                date_range=date_range,
                 columns=columns,
                 links=links
             )
             yield item
 
-        # Pagination: look for a 'Next' button or link
-        next_page = response.css('a:contains("Next")::attr(href), a[title="Next"]::attr(href)').get()
-        if next_page:
-            yield response.follow(
-                next_page,
-                callback=self.save_response,
-                cb_kwargs={'case_type': case_type, 'day': day},
-                dont_filter=True
-            )
+        # Pagination: follow the 'Next' button or link, if any
+        next_request = self.paginator.next_request(
+            response,
+            next_page,
+            formdata=self.search_formdata(case_type, window),
+            page=page,
+            rows=rows,
+            callback=self.results_callback,
+            cb_kwargs={'case_type': case_type, 'window': window},
+        )
+        self.ledger.record(case_type, window, page, len(rows), complete=next_request is None and not truncated)
+        if next_request is not None:
+            # Finish a started search before opening new ones
+            next_request.priority = response.request.priority + 1
+            next_request.meta['truncated'] = truncated
+            next_request.errback = self.search_failed
+            yield next_request
+
+    def schedule_next_window(self, case_type, window):
+        next_window = self.planner.next_window(case_type, window)
+        if next_window is not None:
+            yield self.build_search_request(case_type, next_window)
+        elif self.leaser is None:
+            self.active_walks.discard(case_type)
+            yield from self.start_walks()
+
+    def closed(self, reason):
+        planner = getattr(self, 'planner', None)
+        if planner is not None:
+            self.logger.info(f"Query Planner Stats: {planner.stats}")
+            self.logger.info(f"Pagination Stats: {self.paginator.stats}")
+        if self.ledger is not None:
+            self.ledger.close()
+        if self.dead_letters is not None:
+            self.logger.info(f"Dead letters: {self.dead_letters.counts()} in {self.dead_letters.path}")
+            self.dead_letters.close()
+        if self.parse_pool is not None:
+            self.logger.info(f"Parse Pool Stats: {self.parse_pool.stats}")
+            self.parse_pool.close()
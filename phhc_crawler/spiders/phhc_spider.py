@@ -1,21 +1,57 @@
 import scrapy
 from datetime import datetime, timedelta
-import csv
 import os
 
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from ..extractors import parse_judgment_page
+from ..extsort import ExternalSortWriter
+from ..pagination import Paginator
+from ..parsepool import ParsePool
+
+FIELDNAMES = ['Case Type', 'From Date', 'To Date', 'Case Title', 'Case No', 'Decision Date', 'Judge']
+
+
+def sort_key(row):
+    """Order rows by case type, then chronologically by decision date"""
+    decision_date = row['Decision Date'] or ''
+    for fmt in ('%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            decision_date = datetime.strptime(decision_date, fmt).strftime('%Y-%m-%d')
+            break
+        except ValueError:
+            continue
+    return (row['Case Type'], decision_date)
+
+
 class PHHCJudgmentSpider(scrapy.Spider):
     name = "phhc_judgments_chunked"
     allowed_domains = ["phhc.gov.in"]
     start_urls = ["https://www.phhc.gov.in/home.php?search_param=free_text_search_judgment"]
 
-    def __init__(self):
-        super().__init__()
-        self.items = []
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.row_count = 0
+        self.sorter = None
+        self.paginator = None
+        self.parse_pool = None
+        self.results_callback = self.parse_results
         self.case_types = ["CRM-M"]  # Testing with only one case type
         self.days_per_chunk = 10
         self.date_format = "%d-%m-%Y"
 
     def start_requests(self):
+        # Rows are sorted into run files as they arrive (EXPORT_SORT_RUN_SIZE per run)
+        self.sorter = ExternalSortWriter(
+            FIELDNAMES,
+            key=sort_key,
+            run_size=self.settings.getint('EXPORT_SORT_RUN_SIZE', 50000),
+        )
+        self.paginator = Paginator.from_settings(self.settings, self.logger)
+        self.parse_pool = ParsePool.from_settings(self.settings)
+        if self.parse_pool is not None:
+            self.results_callback = self.parse_results_pooled
+
         end_date = datetime.today()
         start_date = end_date - timedelta(days=60)
 
@@ -24,32 +60,47 @@ class PHHCJudgmentSpider(scrapy.Spider):
             chunk_start = start_date
             while chunk_start < end_date:
                 chunk_end = min(chunk_start + timedelta(days=self.days_per_chunk - 1), end_date)
-                formdata = {
-                    'ctype': case_type,
-                    'dfrom': chunk_start.strftime(self.date_format),
-                    'dto': chunk_end.strftime(self.date_format),
-                    'search_type': 'J'
-                }
+                formdata = self.search_formdata(
+                    case_type,
+                    chunk_start.strftime(self.date_format),
+                    chunk_end.strftime(self.date_format),
+                )
                 yield scrapy.FormRequest(
                     url=self.start_urls[0],
                     formdata=formdata,
-                    callback=self.parse_results,
+                    callback=self.results_callback,
                     cb_kwargs={
                         'case_type': case_type,
                         'from_date': chunk_start.strftime(self.date_format),
                         'to_date': chunk_end.strftime(self.date_format),
                         'page': 1
                     },
-                    dont_filter=True
                 )
                 chunk_start += timedelta(days=self.days_per_chunk)
 
+    def search_formdata(self, case_type, from_date, to_date):
+        return {
+            'ctype': case_type,
+            'dfrom': from_date,
+            'dto': to_date,
+            'search_type': 'J'
+        }
+
     def parse_results(self, response, case_type, from_date, to_date, page):
-        rows = response.css('table#tables11 tr')[1:]  # skip header
-        self.logger.info(f"Scraping: CaseType={case_type}, From={from_date}, To={to_date}, Page={page}, Rows={len(rows)}")
+        rows, next_page_link = parse_judgment_page(response.selector, response.urljoin)
+        yield from self.handle_rows(response, case_type, from_date, to_date, page, rows, next_page_link)
+
+    async def parse_results_pooled(self, response, case_type, from_date, to_date, page):
+        rows, next_page_link = await maybe_deferred_to_future(self.parse_pool.parse(parse_judgment_page, response))
+        return list(self.handle_rows(response, case_type, from_date, to_date, page, rows, next_page_link))
 
-        for row in rows:
-            cols = [td.xpath('string(.)').get().strip() for td in row.css('td')]
+    def handle_rows(self, response, case_type, from_date, to_date, page, rows, next_page_link):
+        # Tagged, lazily formatted: with LOG_QUEUE_ENABLED these are sampled
+        self.logger.info("Scraping: CaseType=%s, From=%s, To=%s, Page=%s, Rows=%s",
+                         case_type, from_date, to_date, page, len(rows),
+                         extra={'event': 'results_page', 'case_type': case_type})
+
+        for cols in rows:
             if len(cols) >= 4:
                 item = {
                     'Case Type': case_type,
@@ -60,45 +111,48 @@ class PHHCJudgmentSpider(scrapy.Spider):
                     'Decision Date': cols[3],
                     'Judge': cols[4] if len(cols) > 4 else None
                 }
-                self.logger.info(f"Extracted row: {item}")
-                self.items.append(item)
-
-        # Handle pagination by simulating clicking next
-        next_page_link = response.css("#tables11 > tbody > tr:last-child > td > a:contains('Next')::attr(href)").get()
-        if next_page_link:
-            next_formdata = {
-                'ctype': case_type,
-                'dfrom': from_date,
-                'dto': to_date,
-                'search_type': 'J'
-            }
-            yield scrapy.FormRequest(
-                url=response.url,
-                formdata=next_formdata,
-                callback=self.parse_results,
-                cb_kwargs={
-                    'case_type': case_type,
-                    'from_date': from_date,
-                    'to_date': to_date,
-                    'page': page + 1
-                },
-                dont_filter=True
-            )
+                self.logger.debug("Extracted row: %s", item,
+                                  extra={'event': 'row_extracted', 'case_type': case_type})
+                self.sorter.add(item)
+                self.row_count += 1
+
+        # Pagination: follow the real next page instead of re-submitting page 1
+        next_request = self.paginator.next_request(
+            response,
+            next_page_link,
+            formdata=self.search_formdata(case_type, from_date, to_date),
+            page=page,
+            rows=rows,
+            callback=self.results_callback,
+            cb_kwargs={
+                'case_type': case_type,
+                'from_date': from_date,
+                'to_date': to_date,
+            },
+        )
+        if next_request is not None:
+            yield next_request
 
     def closed(self, reason):
-        if not self.items:
-            self.logger.warning("No items were scraped!")
+        if self.paginator is not None:
+            self.logger.info(f"Pagination Stats: {self.paginator.stats}")
+        if self.parse_pool is not None:
+            self.logger.info(f"Parse Pool Stats: {self.parse_pool.stats}")
+            self.parse_pool.close()
+        if self.sorter is None:
             return
+        try:
+            if not self.row_count:
+                self.logger.warning("No items were scraped!")
+                return
 
-        output_dir = os.path.join(os.getcwd(), "outputs")
-        os.makedirs(output_dir, exist_ok=True)
-        file_path = os.path.join(output_dir, "phhc_all_judgments_sorted.csv")
-
-        sorted_items = sorted(self.items, key=lambda x: (x['Case Type'], x['Decision Date']))
+            output_dir = os.path.join(os.getcwd(), "outputs")
+            os.makedirs(output_dir, exist_ok=True)
+            file_path = os.path.join(output_dir, "phhc_all_judgments_sorted.csv")
 
-        with open(file_path, "w", newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=sorted_items[0].keys())
-            writer.writeheader()
-            writer.writerows(sorted_items)
+            self.sorter.finish(file_path)
 
-        self.logger.info(f"CSV written with {len(sorted_items)} records to {file_path}.")
+            self.logger.info(f"CSV written with {self.row_count} records to {file_path}.")
+        finally:
+            # Removes the run directory even when nothing was exported
+            self.sorter.close()
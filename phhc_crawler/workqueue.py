@@ -0,0 +1,227 @@
+# Durable work queue for sharded crawls
+#
+# The coordinator (scrapy shard_crawl) fills a SQLite queue with
+# (case_type, date window) work units; every worker crawler leases a few
+# units at a time, heartbeats while it holds them, and marks them done once
+# all of their requests have been answered. Leases that are not renewed
+# expire, so units held by a dead worker go back to the other workers.
+
+import datetime
+import sqlite3
+import time
+
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet.task import LoopingCall
+
+from .planner import DateWindow
+
+
+class WorkQueue:
+    """SQLite-backed queue of (case_type, date window) units with leases"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS units (
+            id            INTEGER PRIMARY KEY,
+            case_type     TEXT    NOT NULL,
+            from_date     TEXT    NOT NULL,
+            to_date       TEXT    NOT NULL,
+            state         TEXT    NOT NULL DEFAULT 'pending',
+            worker        TEXT,
+            lease_expires REAL,
+            attempts      INTEGER NOT NULL DEFAULT 0,
+            row_count     INTEGER,
+            finished_at   REAL,
+            UNIQUE (case_type, from_date, to_date)
+        )
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        # Several processes share the file; wait for each other's write locks
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(self.SCHEMA)
+
+    def populate(self, units):
+        """Add (case_type, DateWindow) units; existing units are left untouched"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO units (case_type, from_date, to_date) VALUES (?, ?, ?)",
+            [(case_type, window.start.isoformat(), window.end.isoformat()) for case_type, window in units],
+        )
+        self.conn.execute("COMMIT")
+
+    def lease(self, worker, lease_seconds, limit=1):
+        """Lease up to ``limit`` pending (or expired) units to ``worker``"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                "SELECT id, case_type, from_date, to_date, attempts FROM units "
+                "WHERE (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                "AND attempts < ? ORDER BY id LIMIT ?",
+                (now, self.max_attempts, limit),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE units SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(worker, now + lease_seconds, row[0]) for row in rows],
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [
+            (unit_id, case_type, DateWindow(datetime.date.fromisoformat(start),
+                                            datetime.date.fromisoformat(end), False), attempts)
+            for unit_id, case_type, start, end, attempts in rows
+        ]
+
+    def heartbeat(self, worker, lease_seconds):
+        """Extend every lease held by ``worker``"""
+        self.conn.execute(
+            "UPDATE units SET lease_expires = ? WHERE state = 'leased' AND worker = ?",
+            (time.time() + lease_seconds, worker),
+        )
+
+    def complete(self, unit_id, row_count):
+        self.conn.execute(
+            "UPDATE units SET state = 'done', row_count = ?, finished_at = ?, lease_expires = NULL "
+            "WHERE id = ?",
+            (row_count, time.time(), unit_id),
+        )
+
+    def release(self, unit_id):
+        """Give a unit back (e.g. after a failed request) for another attempt"""
+        self.conn.execute(
+            "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_expires = NULL WHERE id = ? AND state = 'leased'",
+            (self.max_attempts, unit_id),
+        )
+
+    def release_worker(self, worker):
+        """Release every unit held by a worker that is known to be dead"""
+        for (unit_id,) in self.conn.execute(
+            "SELECT id FROM units WHERE state = 'leased' AND worker = ?", (worker,)
+        ).fetchall():
+            self.release(unit_id)
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM units GROUP BY state").fetchall())
+
+    def is_finished(self):
+        """True when no unit is pending or leased any more"""
+        counts = self.counts()
+        return not counts.get('pending') and not counts.get('leased')
+
+    def close(self):
+        self.conn.close()
+
+
+class WorkUnitLeaser:
+    """Keeps a spider supplied with leased work units and reports them done
+
+    Requests belonging to a unit carry ``meta['work_unit']``; the unit is
+    completed once every one of them has been answered or dropped.
+    """
+
+    def __init__(self, spider, queue, worker, build_requests, units_in_flight=4,
+                 lease_seconds=120, heartbeat_interval=30):
+        self.spider = spider
+        self.queue = queue
+        self.worker = worker
+        self.build_requests = build_requests
+        self.units_in_flight = units_in_flight
+        self.lease_seconds = lease_seconds
+        self.pending = {}
+        self.rows = {}
+        self.attempts = {}
+        self.heartbeat = LoopingCall(queue.heartbeat, worker, lease_seconds)
+        self.heartbeat.start(heartbeat_interval, now=False)
+
+        crawler = spider.crawler
+        crawler.signals.connect(self.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def lease_requests(self):
+        """Lease units up to the in-flight limit and return their first requests"""
+        free = self.units_in_flight - len(self.pending)
+        if free <= 0:
+            return []
+        requests = []
+        for unit_id, case_type, window, attempts in self.queue.lease(self.worker, self.lease_seconds, free):
+            self.pending[unit_id] = 0
+            self.rows[unit_id] = 0
+            self.attempts[unit_id] = attempts
+            for request in self.build_requests(case_type, window):
+                requests.append(self.track(request, unit_id))
+            self.spider.logger.info(f"Leased unit {unit_id}: case_type={case_type}, window={window}")
+        return requests
+
+    def track(self, request, unit_id):
+        request.meta['work_unit'] = unit_id
+        request.errback = self.request_failed
+        if self.attempts.get(unit_id):
+            # A retried unit repeats requests this worker may already have seen
+            request.dont_filter = True
+        self.pending[unit_id] += 1
+        return request
+
+    def process_output(self, response, results):
+        """Tag follow-up requests with the response's unit, then settle the response"""
+        unit_id = response.meta.get('work_unit')
+        for result in results:
+            if unit_id in self.pending:
+                if isinstance(result, Request):
+                    result = self.track(result, unit_id)
+                else:
+                    self.rows[unit_id] += 1
+            yield result
+        yield from self._settle(unit_id)
+
+    def _settle(self, unit_id):
+        if unit_id not in self.pending:
+            return
+        self.pending[unit_id] -= 1
+        if self.pending[unit_id] <= 0:
+            del self.pending[unit_id]
+            self.attempts.pop(unit_id, None)
+            self.queue.complete(unit_id, self.rows.pop(unit_id))
+            yield from self.lease_requests()
+
+    def _abandon(self, unit_id):
+        if self.pending.pop(unit_id, None) is None:
+            return
+        self.rows.pop(unit_id, None)
+        self.attempts.pop(unit_id, None)
+        self.queue.release(unit_id)
+        self.spider.logger.warning(f"Released unit {unit_id} after a failed request")
+
+    def request_failed(self, failure):
+        request = failure.request
+        self._abandon(request.meta.get('work_unit'))
+        self.spider.logger.warning(f"Request failed: {request.url} ({failure.getErrorMessage()})")
+
+    def request_dropped(self, request, spider):
+        # Filtered duplicates never reach a callback
+        unit_id = request.meta.get('work_unit')
+        for follow_up in self._settle(unit_id):
+            self.spider.crawler.engine.crawl(follow_up)
+
+    def spider_idle(self, spider):
+        requests = self.lease_requests()
+        for request in requests:
+            self.spider.crawler.engine.crawl(request)
+        if requests or self.pending or not self.queue.is_finished():
+            # Other workers may still hold units whose leases can expire
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self.heartbeat.running:
+            self.heartbeat.stop()
+        for unit_id in list(self.pending):
+            self._abandon(unit_id)
+        self.queue.close()